@@ -1,15 +1,19 @@
-import logging
 from flask import Flask
 from flask_appbuilder.security.mongoengine.manager import SecurityManager
 from flask_appbuilder import AppBuilder
 from flask_mongoengine import MongoEngine
 
-"""Logging configuration"""
-logging.basicConfig(format='%(asctime)s:%(levelname)s:%(name)s:%(message)s')
-logging.getLogger().setLevel(logging.DEBUG)
-
 app = Flask(__name__)
 app.config.from_object('config')
+
+"""Logging configuration"""
+from app import utilities
+utilities.configure_logging(app.config)
+
+"""Solver cache configuration"""
+from app import shapes
+shapes.configure(app.config)
+
 db = MongoEngine(app)
 appbuilder = AppBuilder(app, security_manager_class=SecurityManager)
 
@@ -27,5 +31,7 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor.close()
 """    
 
-from app import views, models
+from app import views, models, commands, jobs
+
+app.before_request(jobs.warm_up)
 
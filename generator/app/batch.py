@@ -0,0 +1,316 @@
+"""
+Generates many topics from a file of equation specs in one go, e.g. to seed
+a course. Specs are validated and deduplicated up front, the topics are
+inserted in bulk, and their problems are solved across a pool of processes
+and written as each topic finishes. Run with `flask generate-batch` or by
+posting the specs to /batch.
+
+A spec is a JSON object shaped like a Topics document:
+    {"equation": "ax+b=c", "topic": "Two-step equations",
+     "instructions": "Solve for x.", "categories": ["Algebra"],
+     "positive_only": false, "sample_size": null, "seed": null,
+     "variables": [{"variable": "a", "min": 1, "max": 9, "zero_ok": false}, ...]}
+Every letter of the equation needs a variable. As on the form, the one
+last in alphabetical order is solved for. num_type and precision are
+optional, as are positive_only, sample_size and seed.
+"""
+
+# pylint: disable=C0415, W0703
+
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from flask import current_app
+from app import cache, generator, metrics, number_types
+from app.estimate import GenerationTooLarge
+from app.models import Topics
+
+
+class SpecError(ValueError):
+    """A spec can't be generated. The message says why."""
+
+
+def load_specs(text):
+    """Read specs from a JSON list, or from JSON Lines with one spec per line."""
+
+    text = text.strip()
+    if text.startswith('['):
+        return json.loads(text)
+
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def validate_spec(spec):
+    """
+    Check spec and return it as the equation_dict build_topic would make
+    from the form. Raise SpecError if it isn't valid.
+    """
+    from app.topic import Topic
+
+    if not isinstance(spec, dict):
+        raise SpecError('A spec must be a JSON object.')
+    for key in ('equation', 'topic', 'instructions', 'categories', 'variables'):
+        if not spec.get(key):
+            raise SpecError(f'Missing {key}.')
+
+    equation = str(spec['equation'])
+    if equation.count('=') != 1:
+        raise SpecError('The equation needs exactly one =.')
+
+    categories = spec['categories']
+    if isinstance(categories, str):
+        categories = categories.split(', ')
+
+    letters = sorted(set(char for char in equation if char.isalpha()))
+    variables = sorted(spec['variables'], key=lambda var: str(var.get('variable')))
+    if [str(var.get('variable')) for var in variables] != letters:
+        raise SpecError(f"The variables must be exactly {', '.join(letters)}.")
+
+    var_docs = []
+    for var in variables:
+        try:
+            var_doc = {'variable': var['variable'],
+                       'min': int(var['min']),
+                       'max': int(var['max']),
+                       'zero_ok': bool(var.get('zero_ok', True)),
+                       'num_type': var.get('num_type') or 'i'}
+            if var.get('precision'):
+                var_doc['precision'] = int(var['precision'])
+        except (KeyError, TypeError, ValueError):
+            raise SpecError(f"Variable {var.get('variable')} needs an integer min and max.")
+
+        if var_doc['min'] > var_doc['max']:
+            raise SpecError(f"The min of {var_doc['variable']} is above its max.")
+        if var_doc['num_type'] not in number_types.NUM_TYPES:
+            raise SpecError(f"Unknown num_type {var_doc['num_type']!r} for {var_doc['variable']}.")
+        if var_doc.get('precision', 1) < 1:
+            raise SpecError(f"The precision of {var_doc['variable']} must be at least 1.")
+        var_docs.append(var_doc)
+
+    sample_size = spec.get('sample_size') or None
+    seed = spec.get('seed')
+    equation_dict = {'equation': equation,
+                     'topic': str(spec['topic']),
+                     'instructions': str(spec['instructions']),
+                     'categories': [str(category) for category in categories],
+                     'positive_only': bool(spec.get('positive_only', False)),
+                     'sample_size': sample_size and int(sample_size),
+                     'seed': None if seed is None else int(seed),
+                     'variables': var_docs}
+    if equation_dict['sample_size'] is not None and equation_dict['sample_size'] < 1:
+        raise SpecError('sample_size must be at least 1.')
+
+    try:
+        Topic(dict(equation_dict)).prep_equation()
+    except Exception:
+        raise SpecError(f'Could not parse the equation {equation}.')
+
+    return equation_dict
+
+
+def validate_specs(specs):
+    """
+    Validate every spec. Return the unique equation_dicts, and for each
+    spec the index of its equation_dict; identical specs share one. Raise
+    SpecError listing every invalid spec.
+    """
+
+    unique, index, errors = {}, [], []
+    for i, spec in enumerate(specs):
+        try:
+            equation_dict = validate_spec(spec)
+        except SpecError as err:
+            errors.append(f'Spec {i + 1}: {err}')
+            continue
+
+        key = json.dumps(equation_dict, sort_keys=True)
+        index.append(unique.setdefault(key, len(unique)))
+
+    if errors:
+        raise SpecError('\n'.join(errors))
+
+    return [json.loads(key) for key in unique], index
+
+
+def solve(equation_dict, options):
+    """
+    Generate the problems of one topic. Runs in a pool process, so it
+    doesn't touch Mongo. Return the problems and a snapshot of the
+    metrics recorded.
+    """
+    from app.topic import Topic
+
+    with metrics.collect() as recorded, metrics.timed('generation_seconds'):
+        topic = Topic(equation_dict, **options)
+        topic.generate_problems()
+
+    return topic.dict['problems'], recorded.snapshot()
+
+
+class Batch():
+    """
+    Generate and save a topic for each unique spec of a batch.
+        equation_dicts: The unique specs, validated.
+        index: For each spec, the position of its equation_dict.
+        topic_docs: The Topics documents, inserted before solving.
+        results: Per unique spec, its topic id and number of problems, or
+            the error that stopped it.
+        progress: Called with the topics done, the total and the problems
+            saved so far, if given.
+    """
+
+    def __init__(self, specs, progress=None):
+        self.specs = specs
+        self.equation_dicts, self.index = validate_specs(specs)
+        self.progress = progress
+        self.topic_docs = []
+        self.results = []
+        self.done = 0
+        self.saved = 0
+
+
+    def run(self, workers):
+        """
+        Insert the topics, reuse cached problems and solve the rest in a
+        pool of workers processes, or in this process if workers is 1.
+        Return a result per spec, in order. Topics left unfinished by an
+        error or a cancellation are deleted.
+        """
+
+        # Insert every topic at once, so problems can be written as each finishes
+        self.topic_docs = [Topics(**equation_dict, storage=current_app.config['PROBLEM_STORAGE'])
+                           for equation_dict in self.equation_dicts]
+        Topics.objects.insert(self.topic_docs)
+        self.results = [{'topic_id': str(topic_doc.id), 'problems': None, 'error': None}
+                        for topic_doc in self.topic_docs]
+
+        try:
+            pending = self.reuse_cached()
+            options = dict(generator.topic_options(), workers=1)
+            if workers > 1 and len(pending) > 1:
+                self.solve_in_pool(pending, options, workers)
+            else:
+                for i, (key, engine) in pending.items():
+                    self.save(i, key, lambda i=i, engine=engine:
+                              solve(self.equation_dicts[i], dict(options, engine=engine)), False)
+        except BaseException:
+            for topic_doc, result in zip(self.topic_docs, self.results):
+                if result['problems'] is None and result['error'] is None:
+                    topic_doc.delete()
+            raise
+
+        logging.info('Generated %d topics from %d specs, %d problems in all.',
+                     len(self.topic_docs), len(self.specs), self.saved)
+        return [dict(self.results[i]) for i in self.index]
+
+
+    def reuse_cached(self):
+        """
+        Save the topics whose problems are cached and hold the rest to the
+        generation limits, failing those that can't be. Return {i: (cache
+        key, engine)} for the topics left to solve.
+        """
+
+        pending = {}
+        for i, equation_dict in enumerate(self.equation_dicts):
+            with metrics.collect() as recorded, metrics.timed('generation_seconds'):
+                topic = generator.make_topic(dict(equation_dict))
+                key = cache.cache_key(topic)
+                cached = cache.get(key)
+                if cached is not None:
+                    generator.reuse_problems(topic, *cached)
+            if cached is not None:
+                self.finish(i, topic.dict['problems'], recorded.snapshot())
+                continue
+
+            try:
+                cost = generator.apply_limits(topic)
+            except GenerationTooLarge as err:
+                self.fail(i, err)
+                continue
+            if cost is not None and 'sample_size' in cost['adapted']:
+                for field in ('sample_size', 'seed'):
+                    equation_dict[field] = topic.dict[field]
+                self.topic_docs[i].update(set__sample_size=topic.dict['sample_size'],
+                                          set__seed=topic.dict['seed'])
+                key = cache.cache_key(topic)
+            pending[i] = (key, topic.engine)
+
+        return pending
+
+
+    def solve_in_pool(self, pending, options, workers):
+        """Solve the pending topics in a process pool, saving each as it finishes."""
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+            futures = {pool.submit(solve, self.equation_dicts[i], dict(options, engine=engine)): i
+                       for i, (_, engine) in pending.items()}
+            try:
+                for future in as_completed(futures):
+                    i = futures[future]
+                    self.save(i, pending[i][0], future.result, True)
+            except BaseException:
+                pool.shutdown(cancel_futures=True)
+                raise
+
+
+    def save(self, i, key, get_result, remote):
+        """
+        Save topic i from get_result(), which returns its problems and
+        metrics; remote says whether they were recorded in another process.
+        """
+
+        try:
+            problems, recorded = get_result()
+        except Exception as err:
+            self.fail(i, err)
+            return
+
+        if remote:
+            metrics.merge(recorded)
+        self.finish(i, problems, recorded)
+        cache.put(key, self.equation_dicts[i]['equation'], problems, self.topic_docs[i])
+
+
+    def finish(self, i, problems, recorded):
+        """Write the problems and stats of topic i and report progress."""
+
+        with generator.problem_writer(self.topic_docs[i]) as writer:
+            writer.add(problems)
+        stats = metrics.Registry()
+        stats.merge(recorded)
+        self.topic_docs[i].update(set__stats=generator.generation_stats(stats, None))
+        metrics.inc('topics_generated')
+
+        self.results[i]['problems'] = len(problems)
+        self.saved += len(problems)
+        self.report()
+
+
+    def fail(self, i, err):
+        """Record why topic i failed and delete it."""
+
+        logging.error('Batch topic %s failed: %s', self.equation_dicts[i]['topic'], err)
+        self.topic_docs[i].delete()
+        self.results[i].update(topic_id=None, error=str(err))
+        self.report()
+
+
+    def report(self):
+        """Count a finished topic and pass the progress on."""
+
+        self.done += 1
+        if self.progress is not None:
+            self.progress(self.done, len(self.topic_docs), self.saved)
+
+
+def run(specs, workers=None, progress=None):
+    """
+    Generate and save a topic for each unique spec, solving in a pool of
+    workers processes (BATCH_WORKERS by default). Return a result per spec,
+    in order: its topic id and number of problems, or the error that
+    stopped it. Raise SpecError, before saving anything, if a spec is
+    invalid.
+    """
+
+    return Batch(specs, progress).run(workers or current_app.config['BATCH_WORKERS'])
@@ -0,0 +1,168 @@
+"""
+Caches generated problems by what determines them: the parsed equation,
+the parameters of each variable and the generation options. An in-process
+LRU sits in front of the ProblemCache collection in Mongo, which only
+points at a saved topic with those problems, so they're read back through
+storage.py and never copied into one oversized document. Writing to the
+cache is best-effort: a failure is logged and never fails a generation.
+"""
+
+# pylint: disable=W0603
+
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from flask import current_app
+from app import metrics, number_types, storage
+from app.models import ProblemCache, Topics
+
+
+class LRUCache():
+    """
+    Store the most recently used entries, evicting the least recently used
+    one when either limit is exceeded.
+        max_entries: Maximum number of cached topics.
+        max_problems: Maximum number of problems across all cached topics.
+        hits, misses: Lookup counters.
+    """
+
+    def __init__(self, max_entries, max_problems):
+        self.max_entries = max_entries
+        self.max_problems = max_problems
+        self.entries = OrderedDict()
+        self.problem_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+
+    def get(self, key):
+        """Return the entry for key, or None."""
+
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+
+    def put(self, key, entry):
+        """Store entry, an (equation, problems) pair, under key."""
+
+        with self.lock:
+            if key in self.entries:
+                self.problem_count -= len(self.entries.pop(key)[1])
+            if len(entry[1]) > self.max_problems:
+                return
+
+            self.entries[key] = entry
+            self.problem_count += len(entry[1])
+            while len(self.entries) > self.max_entries or self.problem_count > self.max_problems:
+                self.problem_count -= len(self.entries.popitem(last=False)[1][1])
+
+
+# Shared by all requests in this process. Created on first use, sized by
+# TOPIC_CACHE_SIZE and TOPIC_CACHE_MAX_PROBLEMS.
+memory_cache = None
+
+# Lookup counters for the Mongo layer
+db_stats = {'hits': 0, 'misses': 0}
+
+
+def get_memory_cache():
+    """Return the in-process cache, creating it from the app config."""
+
+    global memory_cache
+    if memory_cache is None:
+        memory_cache = LRUCache(current_app.config['TOPIC_CACHE_SIZE'],
+                                current_app.config['TOPIC_CACHE_MAX_PROBLEMS'])
+
+    return memory_cache
+
+
+def cache_key(topic):
+    """
+    Hash everything that determines a topic's problems. The equation is
+    hashed in its parsed form, so spacing and term order don't matter.
+    """
+    from sympy import srepr # pylint: disable=C0415
+
+    variables = [[var['variable'], int(var['min']), int(var['max']),
+                  bool(var['zero_ok']), var['num_type'], number_types.precision(var)]
+                 for var in topic.variables]
+    canonical = json.dumps({'equation': srepr(topic.prep_equation()),
+                            'variables': variables,
+                            'positive_only': bool(topic.dict['positive_only']),
+                            'sample': [topic.dict.get('sample_size'), topic.dict.get('seed')],
+                            'max_problems': topic.max_problems})
+
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def get(key):
+    """Return the cached (equation, problems) for key, or None."""
+
+    entry = get_memory_cache().get(key)
+    if entry is not None:
+        metrics.inc('cache_lookups', layer='memory', result='hit')
+        return entry
+    metrics.inc('cache_lookups', layer='memory', result='miss')
+
+    # Entries from before they pointed at a topic, or whose topic is gone,
+    # are misses
+    cached = ProblemCache.objects(key=key).only('equation', 'topic').as_pymongo().first()
+    topic_doc = None
+    if cached is not None and cached.get('topic') is not None:
+        topic_doc = Topics.objects(id=cached['topic']).first()
+    if topic_doc is None:
+        db_stats['misses'] += 1
+        metrics.inc('cache_lookups', layer='db', result='miss')
+        return None
+
+    db_stats['hits'] += 1
+    metrics.inc('cache_lookups', layer='db', result='hit')
+    entry = (cached['equation'], storage.read_problems(topic_doc))
+    get_memory_cache().put(key, entry)
+    return entry
+
+
+def put(key, equation, problems, topic_doc):
+    """
+    Cache problems generated for equation under key, once they're all
+    saved as the problems of topic_doc.
+    """
+
+    get_memory_cache().put(key, (equation, problems))
+    try:
+        # Also drops the problems embedded by earlier versions
+        ProblemCache.objects(key=key).update_one(
+            __raw__={'$set': {'equation': equation, 'topic': topic_doc.id},
+                     '$unset': {'problems': ''}},
+            upsert=True)
+    except Exception: # pylint: disable=W0703
+        logging.exception('Could not cache the problems of %s.', equation)
+
+
+def forget(topic_doc):
+    """Stop reusing the problems of topic_doc, before they're replaced."""
+
+    try:
+        ProblemCache.objects(topic=topic_doc.id).delete()
+    except Exception: # pylint: disable=W0703
+        logging.exception('Could not remove the cache entries of %s.', topic_doc.equation)
+
+
+def stats():
+    """Return hit/miss counters and the size of each cache layer."""
+
+    cache = get_memory_cache()
+    return {'memory': {'hits': cache.hits,
+                       'misses': cache.misses,
+                       'entries': len(cache.entries),
+                       'problems': cache.problem_count},
+            'db': dict(db_stats)}
@@ -0,0 +1,95 @@
+"""
+Command line tools, run with the Flask CLI, e.g. `flask migrate-problems`.
+"""
+
+# pylint: disable=W0212
+
+import click
+from pymongo import UpdateOne
+from app import app, batch, features, generator, storage
+from app.models import Topics, Problems, ProblemBlocks
+
+
+@app.cli.command('migrate-problems')
+def migrate_problems():
+    """
+    Move problems embedded in Topics documents into the Problems
+    collection. Topics are migrated one at a time, so the command can be
+    run again after an interruption.
+    """
+
+    topics = Topics._get_collection()
+    migrated = 0
+    for topic in topics.find({'problems': {'$exists': True}}, {'problems': 1}):
+        topic_doc = Topics.objects.only('storage', 'variables', 'generation').get(id=topic['_id'])
+        storage.delete_problems(topic_doc)
+        generator.save_problems(topic_doc, topic['problems'])
+        topics.update_one({'_id': topic['_id']}, {'$unset': {'problems': ''}})
+
+        migrated += 1
+        click.echo(f"Moved {len(topic['problems'])} problems of topic {topic['_id']}.")
+
+    click.echo(f'Migrated {migrated} topics.')
+
+
+@app.cli.command('migrate-generations')
+def migrate_generations():
+    """
+    Drop the unique indexes on (topic, position) from before problems had
+    generations, which stop a topic's ranges from being updated. Indexes
+    on (topic, generation, position) replace them. Safe to run again.
+    """
+
+    for document in (Problems, ProblemBlocks):
+        collection = document._get_collection()
+        for name, index in collection.index_information().items():
+            if [field for field, _ in index['key']] == ['topic', 'position']:
+                collection.drop_index(name)
+                click.echo(f'Dropped index {name} from {collection.name}.')
+
+    click.echo('Migrated the problem indexes.')
+
+
+@app.cli.command('add-features')
+def add_features():
+    """
+    Store the features of problems saved before they existed, so they
+    can be queried on /problems/query. Safe to run again.
+    """
+
+    collection = Problems._get_collection()
+    batch_size = app.config['PROBLEM_BATCH_SIZE']
+    updates, updated = [], 0
+    for problem in collection.find({'features': {'$exists': False}}, {'values': 1}):
+        updates.append(UpdateOne({'_id': problem['_id']},
+                                 {'$set': {'features': features.problem_features(problem['values'])}}))
+        if len(updates) >= batch_size:
+            updated += collection.bulk_write(updates, ordered=False).modified_count
+            updates = []
+    if updates:
+        updated += collection.bulk_write(updates, ordered=False).modified_count
+
+    click.echo(f'Added features to {updated} problems.')
+
+@app.cli.command('generate-batch')
+@click.argument('specs', type=click.File())
+@click.option('--workers', type=int, help='Processes to solve across, BATCH_WORKERS by default.')
+def generate_batch(specs, workers):
+    """
+    Generate a topic for each equation spec in SPECS, a JSON list or JSON
+    Lines file. Identical specs are generated once. See app/batch.py for
+    the shape of a spec.
+    """
+
+    try:
+        results = batch.run(batch.load_specs(specs.read()), workers=workers,
+                            progress=lambda done, total, problems:
+                            click.echo(f'{done}/{total} topics, {problems} problems.'))
+    except batch.SpecError as err:
+        raise click.ClickException(f'Invalid specs, nothing was generated:\n{err}')
+
+    for i, result in enumerate(results, 1):
+        if result['error'] is None:
+            click.echo(f"Spec {i}: topic {result['topic_id']}, {result['problems']} problems.")
+        else:
+            click.echo(f"Spec {i}: failed, {result['error']}")
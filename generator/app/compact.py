@@ -0,0 +1,92 @@
+"""
+Packs problems into a compressed, columnar block of typed arrays, for
+topics stored with PROBLEM_STORAGE = 'compact'. Each input variable is a
+column of numerators, plus denominators when it isn't an integer, in the
+smallest integer type that holds them. The answers are flattened into
+columns the same way, with a column of how many each problem has. Only
+the values are kept: the LaTeX problem and answer are rendered again when
+a block is read, see storage.py. numpy is imported on first use, so
+importing the app doesn't load it.
+"""
+
+# pylint: disable=C0415
+
+import io
+from fractions import Fraction
+from app import number_types
+
+
+def typed_array(numbers):
+    """Return numbers as an array of the smallest integer type that holds them all."""
+    import numpy as np
+
+    if not numbers:
+        return np.array([], dtype=np.int8)
+
+    dtype = np.result_type(np.min_scalar_type(min(numbers)), np.min_scalar_type(max(numbers)))
+    return np.array(numbers, dtype=dtype)
+
+
+def add_column(arrays, name, var, values):
+    """Store a list of values of var as columns of arrays, named after name."""
+
+    if number_types.num_type(var) == 'i':
+        arrays[name] = typed_array(values)
+        return
+
+    fractions = [Fraction(number_types.parse(value)) for value in values]
+    arrays[name] = typed_array([value.numerator for value in fractions])
+    arrays[f'{name}.den'] = typed_array([value.denominator for value in fractions])
+
+
+def read_column(arrays, name, var):
+    """Return the values of var stored under name, as they are stored in a problem."""
+
+    numerators = arrays[name].tolist()
+    if number_types.num_type(var) == 'i':
+        return numerators
+
+    return [number_types.format_value(var, Fraction(numerator, denominator))
+            for numerator, denominator in zip(numerators, arrays[f'{name}.den'].tolist())]
+
+
+def encode(problems, variables):
+    """Return the values of problems, for a topic's variables, as a compressed block."""
+    import numpy as np
+
+    x = variables[-1]
+    arrays = {}
+    for var in variables[:-1]:
+        add_column(arrays, var['variable'], var,
+                   [problem['values'][var['variable']] for problem in problems])
+
+    answers = [problem['values'][x['variable']] for problem in problems]
+    arrays['answers'] = typed_array([len(problem_answers) for problem_answers in answers])
+    add_column(arrays, x['variable'], x, [answer for problem_answers in answers
+                                          for answer in problem_answers])
+
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode(data, variables):
+    """Return the problems in a block, with only their values."""
+    import numpy as np
+
+    x = variables[-1]
+    with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+        columns = {var['variable']: read_column(arrays, var['variable'], var)
+                   for var in variables[:-1]}
+        counts = arrays['answers'].tolist()
+        answers = read_column(arrays, x['variable'], x)
+
+    problems = []
+    start = 0
+    for i, count in enumerate(counts):
+        values = {name: column[i] for name, column in columns.items()}
+        values[x['variable']] = answers[start:start + count]
+        problems.append({'values': values})
+        start += count
+
+    return problems
@@ -0,0 +1,161 @@
+"""
+Predicts what generating a topic will cost before it's generated. The
+combinations are counted from the variable ranges, and a random sample of
+them is solved with the topic's own solver to measure the time per
+combination, the fraction that are valid and the memory per problem.
+generator.apply_limits holds the prediction against the limits in
+config.py.
+"""
+
+# pylint: disable=C0415
+
+import random
+import sys
+import time
+
+
+# Combinations solved in the first calibration batch; later batches double
+FIRST_BATCH = 50
+
+# Combinations are numbered with int64 when drawn, see Topic.generate_input_grid
+MAX_COMBINATIONS = 2**63 - 1
+
+# Memory per value listed by Topic.generate_var_ranges: a Python int in a
+# list, plus its int64 copy in each grid
+VALUE_BYTES = 44
+
+
+class GenerationTooLarge(ValueError):
+    """A topic is predicted to take too long or too much memory to generate."""
+
+
+def deep_size(value):
+    """Return the bytes taken by value, a problem dict, and everything in it."""
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key) + deep_size(item) for key, item in value.items())
+    elif isinstance(value, list):
+        size += sum(deep_size(item) for item in value)
+    return size
+
+
+def calibrate(topic, max_combinations, max_seconds, seed=0):
+    """
+    Solve and write random combinations of topic, in doubling batches,
+    until max_combinations were drawn or max_seconds passed. Return a dict
+    of the combinations in all, the ones drawn, the valid problems among
+    them and the bytes those take, and the seconds spent preparing. The
+    timed combinations and valid problems are given with the seconds spent
+    solving and writing them.
+
+    Work done once per topic counts as preparation: the first batch, and
+    building LaTeX templates, which get reused over a whole generation.
+    Writing is timed again once the batch's templates are built.
+    """
+
+    var_ranges = topic.generate_var_ranges()
+    total = topic.count_combinations(var_ranges)
+    limit = min(total, max_combinations)
+    rng = random.Random(seed)
+
+    start = time.perf_counter()
+    prepped_equation = topic.prep_equation()
+    topic.compile_solver(prepped_equation)
+    setup_seconds = time.perf_counter() - start
+
+    drawn, valid, problem_bytes = set(), 0, 0
+    batches = []
+    batch_size = FIRST_BATCH
+    deadline = time.perf_counter() + max_seconds
+    while len(drawn) < limit and time.perf_counter() < deadline:
+        rows = set()
+        while len(rows) < min(batch_size, limit - len(drawn)):
+            row = rng.randrange(total)
+            if row not in drawn:
+                drawn.add(row)
+                rows.add(row)
+
+        start = time.perf_counter()
+        valid_combos = topic.find_valid_combos(prepped_equation, var_ranges,
+                                               topic.generate_input_rows(var_ranges, sorted(rows)))
+        solve_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        topic.write_problems(valid_combos)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        topic.write_problems([{'values': combo['values']} for combo in valid_combos])
+        write_seconds = time.perf_counter() - start
+
+        setup_seconds += max(build_seconds - write_seconds, 0)
+        batches.append((len(rows), len(valid_combos), solve_seconds, write_seconds))
+        valid += len(valid_combos)
+        problem_bytes += sum(deep_size(combo) for combo in valid_combos)
+        batch_size *= 2
+
+    if len(batches) > 1:
+        setup_seconds += sum(batches.pop(0)[2:])
+
+    # Calibration isn't part of the generation
+    topic.pruned = 0
+    return {'combinations': total,
+            'drawn': len(drawn),
+            'valid': valid,
+            'problem_bytes': problem_bytes,
+            'setup_seconds': setup_seconds,
+            'timed': sum(batch[0] for batch in batches),
+            'timed_valid': sum(batch[1] for batch in batches),
+            'solve_seconds': sum(batch[2] for batch in batches),
+            'write_seconds': sum(batch[3] for batch in batches)}
+
+
+def unit_costs(calibration):
+    """Return the seconds to solve a combination and to write a valid problem."""
+
+    return (calibration['solve_seconds'] / max(calibration['timed'], 1),
+            calibration['write_seconds'] / max(calibration['timed_valid'], 1))
+
+
+def predict(topic, calibration):
+    """
+    Return the predicted cost of generating topic from a calibration: the
+    combinations it will solve, the problems it will find, the seconds it
+    will take and the bytes its problems will take in memory.
+
+    Valid problems are assumed to be spread evenly over the combinations.
+    The calibration draws from all of them, but generation stops at
+    max_problems in the order of the combinations, so when valid problems
+    are bunched towards the end of that order, more combinations get
+    solved than predicted.
+    """
+    from app.topic import MIN_ACCEPTANCE_RATE
+
+    total = calibration['combinations']
+    rate = calibration['valid'] / max(calibration['drawn'], 1)
+    problems = min(total * rate, topic.max_problems)
+
+    # Generation stops at max_problems, and a sample once it's drawn,
+    # unless valid combinations are too rare to sample
+    sample_size = topic.dict.get('sample_size')
+    if sample_size:
+        problems = min(problems, int(sample_size))
+    if rate == 0 or (sample_size and rate < MIN_ACCEPTANCE_RATE):
+        combinations = total
+    else:
+        combinations = min(total, problems / rate)
+
+    seconds_per_combination, seconds_per_problem = unit_costs(calibration)
+    bytes_per_problem = calibration['problem_bytes'] / max(calibration['valid'], 1)
+    return {'combinations': total,
+            'solved_combinations': round(combinations),
+            'valid_rate': rate,
+            'problems': round(problems),
+            'seconds': calibration['setup_seconds']
+                       + (combinations * seconds_per_combination
+                          + problems * seconds_per_problem) / topic.workers,
+            'memory_bytes': round(problems * bytes_per_problem),
+            'engine': topic.engine,
+            'sample_size': int(sample_size) if sample_size else None}
+
@@ -0,0 +1,94 @@
+"""
+Streams a topic's problems as CSV, JSON Lines or a LaTeX worksheet. Each
+export walks a cursor over the topic's problems, or its blocks if stored
+compactly, and yields the text in chunks, so memory stays flat no matter
+how many problems the topic has.
+"""
+
+import csv
+import io
+import json
+from app.storage import iterate_problems
+
+
+# Special characters in LaTeX text mode and their escaped form
+LATEX_ESCAPES = {'\\': r'\textbackslash{}', '&': r'\&', '%': r'\%', '$': r'\$',
+                 '#': r'\#', '_': r'\_', '{': r'\{', '}': r'\}',
+                 '~': r'\textasciitilde{}', '^': r'\textasciicircum{}'}
+
+
+def batched(lines, batch_size):
+    """Join lines into chunks of batch_size lines."""
+
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def escape_latex(text):
+    """Escape text for LaTeX text mode."""
+    return ''.join(LATEX_ESCAPES.get(char, char) for char in text)
+
+
+def csv_lines(topic_doc, batch_size):
+    """Yield a header, then one CSV line per problem."""
+
+    variables = [var.variable for var in topic_doc.variables]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(row):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        return buffer.getvalue()
+
+    yield line(variables + ['problem', 'answer'])
+    for problem in iterate_problems(topic_doc, batch_size):
+        # The answer variable holds a list of answers
+        values = [problem['values'][var] for var in variables]
+        values[-1] = ';'.join(str(answer) for answer in values[-1])
+        yield line(values + [problem['problem'], problem['answer']])
+
+
+def jsonl_lines(topic_doc, batch_size):
+    """Yield one JSON object per problem."""
+
+    for problem in iterate_problems(topic_doc, batch_size):
+        yield json.dumps(problem) + '\n'
+
+
+def latex_lines(topic_doc, batch_size):
+    """Yield the source of a worksheet listing the problems, then an answer key."""
+
+    yield '\\documentclass{article}\n\\usepackage{amsmath}\n\\begin{document}\n'
+    yield f'\\section*{{{escape_latex(topic_doc.topic)}}}\n'
+    yield f'{escape_latex(topic_doc.instructions)}\n'
+
+    yield '\\begin{enumerate}\n'
+    for problem in iterate_problems(topic_doc, batch_size):
+        yield f"\\item ${problem['problem']}$\n"
+    yield '\\end{enumerate}\n'
+
+    yield '\\newpage\n\\section*{Answers}\n\\begin{enumerate}\n'
+    for problem in iterate_problems(topic_doc, batch_size):
+        yield f"\\item ${problem['answer']}$\n"
+    yield '\\end{enumerate}\n\\end{document}\n'
+
+
+# Export formats: (line generator, mimetype, file extension)
+FORMATS = {'csv': (csv_lines, 'text/csv', 'csv'),
+           'jsonl': (jsonl_lines, 'application/x-ndjson', 'jsonl'),
+           'latex': (latex_lines, 'application/x-tex', 'tex')}
+
+
+def stream(topic_doc, export_format, batch_size):
+    """Yield the export of topic_doc in export_format, batch_size lines per chunk."""
+
+    lines = FORMATS[export_format][0]
+    return batched(lines(topic_doc, batch_size), batch_size)
@@ -0,0 +1,109 @@
+"""
+Features of each problem that worksheets are picked by: how many answers
+it has, how large and what sign they are, and how large the given values
+are. They're computed when problems are written and stored with them, so
+the query on /problems/query runs on the Problems indexes instead of
+loading a whole topic and filtering it.
+"""
+
+import operator
+
+
+# Query argument: (features field, mongoengine operator, type)
+FILTERS = {'answers': ('answers', None, int),
+           'min_answers': ('answers', 'gte', int),
+           'max_answers': ('answers', 'lte', int),
+           'answer_above': ('answer_min', 'gt', float),
+           'answer_below': ('answer_max', 'lt', float),
+           'max_answer_size': ('answer_size', 'lte', float),
+           'max_coefficient': ('coefficient_size', 'lte', float),
+           'negatives': ('negatives', None, 'bool')}
+
+# mongoengine operator: the comparison it makes
+OPERATORS = {None: operator.eq,
+             'gt': operator.gt,
+             'gte': operator.ge,
+             'lt': operator.lt,
+             'lte': operator.le}
+
+
+def as_float(value):
+    """Return a stored value, an int or a string like '3/4' or '0.25', as a float."""
+
+    if isinstance(value, str) and '/' in value:
+        numerator, denominator = value.split('/')
+        return int(numerator) / int(denominator)
+    return float(value)
+
+
+def problem_features(values):
+    """
+    Return the features of a problem from its values, where the answers
+    are the one list.
+        answers: The number of answers.
+        answer_min, answer_max: The smallest and largest answer, if any.
+        answer_size: The largest absolute answer, if any.
+        negatives: Whether any given value is negative.
+        coefficient_size: The largest absolute given value.
+    """
+
+    answers, given = [], []
+    for value in values.values():
+        if isinstance(value, list):
+            answers = [as_float(answer) for answer in value]
+        else:
+            given.append(as_float(value))
+
+    return {'answers': len(answers),
+            'answer_min': min(answers) if answers else None,
+            'answer_max': max(answers) if answers else None,
+            'answer_size': max(abs(answer) for answer in answers) if answers else None,
+            'negatives': any(value < 0 for value in given),
+            'coefficient_size': max((abs(value) for value in given), default=0.0)}
+
+
+def add_features(problems):
+    """Give problems written before features existed their features."""
+
+    for problem in problems:
+        if 'features' not in problem:
+            problem['features'] = problem_features(problem['values'])
+
+
+def parse_filters(args):
+    """
+    Turn query arguments named in FILTERS into Problems.objects keyword
+    arguments. Raise ValueError for a value of the wrong type.
+    """
+
+    filters = {}
+    for name, (field, operator, kind) in FILTERS.items():
+        if name not in args:
+            continue
+
+        if kind == 'bool':
+            if args[name].lower() not in ('true', 'false'):
+                raise ValueError(f'{name} must be true or false.')
+            value = args[name].lower() == 'true'
+        else:
+            value = kind(args[name])
+
+        key = f'features__{field}' if operator is None else f'features__{field}__{operator}'
+        filters[key] = value
+
+    return filters
+
+
+def matches(problem_features, filters):
+    """
+    Whether problem_features pass filters from parse_filters, compared
+    like Mongo would: a missing answer matches no comparison.
+    """
+
+    for key, value in filters.items():
+        _, field, *operator_name = key.split('__')
+        actual = problem_features[field]
+        if actual is None or not OPERATORS[operator_name[0] if operator_name else None](actual, value):
+            return False
+
+    return True
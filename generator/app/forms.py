@@ -1,8 +1,9 @@
 """Forms to securely accept equation parameters."""
 
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, IntegerField, BooleanField, HiddenField
-from wtforms.validators import InputRequired, ValidationError
+from wtforms import StringField, SubmitField, IntegerField, BooleanField, HiddenField, SelectField
+from wtforms.validators import InputRequired, ValidationError, Optional, NumberRange
+from app.number_types import NUM_TYPES
 
 
 # Custom validators
@@ -25,9 +26,15 @@ class VariableForm(FlaskForm):
     minimum = IntegerField("Min", validators=[InputRequired(), validate_int])
     maximum = IntegerField("Max", validators=[InputRequired(), validate_int, validate_max_gte_min])
     zero_ok = BooleanField("Zero Ok", default="checked")
+    num_type = SelectField("Type", choices=list(NUM_TYPES.items()), default='i')
+    precision = IntegerField("Precision", validators=[Optional(), NumberRange(min=1, max=1000)])
 
 class EquationParametersForm(FlaskForm):
     positive_only = BooleanField("Positive Answers Only", default=False)
     topic = StringField("Topic: ", validators=[InputRequired()])
     instructions = StringField("Instructions: ", validators=[InputRequired()])
     categories = StringField("Categories: ", validators=[InputRequired()])
+    sample_size = IntegerField("Number of Problems (blank for all): ",
+                               validators=[Optional(), NumberRange(min=1)])
+    seed = IntegerField("Random Seed (optional): ", validators=[Optional()])
+    profile = BooleanField("Capture a Profile", default=False)
@@ -1,10 +1,22 @@
 """Processes user inputs, then writes topic and problem data to the db."""
 
 import logging
-from app import utilities
-from app.topic import Topic
+import os
+import random
+from datetime import datetime
+from flask import current_app
+from app import cache, estimate, metrics, number_types, storage
+from app.persistence import CompactWriter, ProblemWriter
 from app.forms import EquationForm, VariableForm, EquationParametersForm
-from app.models import Topics
+from app.models import Topics, Variables
+
+
+# Generated by warm_up() to get the solver ready
+WARM_UP_EQUATION = {'equation': 'ax**2+bx+c=0',
+                    'positive_only': False,
+                    'variables': [{'variable': var, 'min': -1, 'max': 1,
+                                   'zero_ok': True, 'num_type': 'i'}
+                                  for var in 'abcx']}
 
 
 def process_equation(equation_form, equation_params):
@@ -15,7 +27,6 @@ def process_equation(equation_form, equation_params):
     """
 
     equation = equation_form.equation.data
-    print(equation)
 
     # Identify the vars in the equation and create a VariableForm for each
     variables = sorted(set([char for char in equation if char.isalpha()]))
@@ -23,7 +34,7 @@ def process_equation(equation_form, equation_params):
     for var in variables:
         var = VariableForm()
         variable_forms.append(var)
-    print(variables, variable_forms)
+    logging.debug('Variables of %s: %s', equation, variables)
 
     return equation, variables, variable_forms
 
@@ -39,12 +50,21 @@ def package_variables(data_dict):
         else:
             zero_result = False
 
+        # Forms from before num_type existed only send integers
+        num_types = data_dict.getlist('num_type')
+        precisions = data_dict.getlist('precision')
+        num_type = num_types[i] if i < len(num_types) else 'i'
+        if num_type not in number_types.NUM_TYPES:
+            raise ValueError(f'Unknown num_type {num_type!r} for {variable}.')
+
         var_dict = {
             'variable': variable,
             'min': int(data_dict.getlist('minimum')[i]),
             'max': int(data_dict.getlist('maximum')[i]),
             'zero_ok': zero_result,
-            'num_type': 'i'} ### Temporarily hard coded, but will need to fix ###
+            'num_type': num_type}
+        if num_type != 'i' and i < len(precisions) and precisions[i]:
+            var_dict['precision'] = int(precisions[i])
 
         var_docs.append(var_dict)
 
@@ -63,33 +83,344 @@ def create_equation_dict(var_docs, data_dict):
     else:
         positive_only = False
 
+    # Sample problems at random only if a number of problems was given
+    sample_size = data_dict.get('sample_size') or None
+    seed = data_dict.get('seed') or None
+
     # Package equation parameters into equation_dict
     equation_dict = {'equation': data_dict['eq'],
                      'topic': data_dict['topic'],
                      'instructions': data_dict['instructions'],
                      'categories': category_list,
                      'positive_only': positive_only,
+                     'sample_size': sample_size and int(sample_size),
+                     'seed': seed and int(seed),
                      'variables': var_docs}
 
-    logging.info(equation_dict)
     return equation_dict
 
 
-def build_topic(data_dict):
-    """Get equation info, generate problems and write result to db."""
+def reuse_problems(topic, equation, problems):
+    """
+    Give topic a copy of cached problems. If they were generated from an
+    equivalent but differently written equation, rewrite the LaTeX.
+    """
+
+    if equation == topic.equation:
+        topic.dict['problems'] = list(problems)
+    else:
+        topic.dict['problems'] = [{'values': dict(problem['values'])} for problem in problems]
+        topic.write_problems(topic.dict['problems'])
+
+    logging.info('Reused %d cached problems.', len(topic.dict['problems']))
+
+
+def topic_options():
+    """Return the Topic keyword arguments set in the app config."""
+
+    if current_app.config['TOPIC_EXECUTION'] == 'parallel':
+        workers = current_app.config['TOPIC_WORKERS']
+    else:
+        workers = 1
+
+    return {'chunk_size': current_app.config['TOPIC_CHUNK_SIZE'],
+            'max_problems': current_app.config['TOPIC_MAX_PROBLEMS'],
+            'workers': workers}
+
+
+def make_topic(eq_dict):
+    """
+    Create a Topic for eq_dict, configured from the app config. The solver
+    machinery, sympy included, is only imported here, on first use, so
+    workers boot without it.
+    """
+    from app.topic import Topic # pylint: disable=C0415
+
+    return Topic(eq_dict, **topic_options())
+
+
+def warm_up():
+    """
+    Import the solver and parse and compile WARM_UP_EQUATION, so the first
+    generation in this process doesn't pay for it.
+    """
+
+    topic = make_topic(dict(WARM_UP_EQUATION))
+    topic.compile_solver(topic.prep_equation())
+
+
+def within_limits(cost):
+    """Whether a predicted cost is within GENERATION_MAX_SECONDS and GENERATION_MAX_MEMORY."""
+
+    return cost['seconds'] <= current_app.config['GENERATION_MAX_SECONDS'] \
+        and cost['memory_bytes'] <= current_app.config['GENERATION_MAX_MEMORY']
+
+
+def describe_cost(topic, cost):
+    """Explain why topic was rejected."""
+
+    return (f"Generating {topic.equation} would solve about {cost['solved_combinations']:,} "
+            f"combinations in {cost['seconds']:,.0f}s and keep {cost['problems']:,} problems "
+            f"in {cost['memory_bytes'] / 2**20:,.0f} MB, over the limits of "
+            f"{current_app.config['GENERATION_MAX_SECONDS']:,}s and "
+            f"{current_app.config['GENERATION_MAX_MEMORY'] / 2**20:,.0f} MB. "
+            "Narrow the ranges or ask for a sample.")
+
+
+def describe_ranges(topic, combinations, values):
+    """Explain why topic was rejected before it could be estimated."""
+
+    return (f"{topic.equation} has {combinations:,} combinations of {values:,} values, "
+            "too many to generate or sample. Narrow the ranges.")
+
+
+def apply_limits(topic, always=False):
+    """
+    Estimate what generating topic will cost and hold it to the limits in
+    the app config, switching its engine or sampling it if
+    GENERATION_OVER_LIMIT allows, see config.py. Return the estimate for
+    the topic as it will be generated, with the changes made under
+    'adapted', or None if it's too small to need one, unless always is
+    set. Raise estimate.GenerationTooLarge if it can't be kept in limits.
+    """
+
+    config = current_app.config
+    combinations = topic.count_input_combinations()
+    if combinations <= config['ESTIMATE_COMBINATIONS'] and not always:
+        return None
+
+    # Estimating lists every value and numbers the combinations, so ranges
+    # too large for either are rejected first
+    values = sum(topic.count_values().values())
+    if combinations > estimate.MAX_COMBINATIONS \
+       or values * estimate.VALUE_BYTES > config['GENERATION_MAX_MEMORY']:
+        raise estimate.GenerationTooLarge(describe_ranges(topic, combinations, values))
+
+    def calibrate():
+        return estimate.calibrate(topic, config['ESTIMATE_COMBINATIONS'], config['ESTIMATE_SECONDS'])
+
+    calibration = calibrate()
+    cost = estimate.predict(topic, calibration)
+    adapted = []
+    if not within_limits(cost) and config['GENERATION_OVER_LIMIT'] == 'adapt':
+        # The numpy engine gives the same problems, faster
+        if topic.integer and topic.engine != 'numpy':
+            topic.engine = 'numpy'
+            calibration = calibrate()
+            cost = estimate.predict(topic, calibration)
+            adapted.append('engine')
+
+        # Otherwise, the largest sample that fits the time and memory left
+        if not within_limits(cost) and cost['valid_rate'] > 0 and calibration['valid']:
+            seconds_per_combination, seconds_per_problem = estimate.unit_costs(calibration)
+            seconds_per_problem = (seconds_per_combination / cost['valid_rate']
+                                   + seconds_per_problem) / topic.workers
+            bytes_per_problem = calibration['problem_bytes'] / calibration['valid']
+            sample_size = int(min((config['GENERATION_MAX_SECONDS'] - calibration['setup_seconds'])
+                                  / seconds_per_problem,
+                                  config['GENERATION_MAX_MEMORY'] / bytes_per_problem,
+                                  cost['problems']))
+            if sample_size >= 1:
+                topic.dict['sample_size'] = sample_size
+                if topic.dict.get('seed') is None:
+                    topic.dict['seed'] = random.randrange(2**31)
+                cost = estimate.predict(topic, calibration)
+                adapted.append('sample_size')
+
+    if not within_limits(cost):
+        raise estimate.GenerationTooLarge(describe_cost(topic, cost))
+
+    cost['adapted'] = adapted
+    logging.info('Estimated %s: %d of %d combinations, %d problems, %.1fs, %d bytes%s.',
+                 topic.equation, cost['solved_combinations'], cost['combinations'],
+                 cost['problems'], cost['seconds'], cost['memory_bytes'],
+                 f", adapted {', '.join(adapted)}" if adapted else '')
+    return cost
+
+
+def estimate_topic(data_dict):
+    """
+    Return what generating the topic in the submitted form would cost,
+    as apply_limits would leave it, or why it would be rejected under
+    'error'.
+    """
+
+    topic = make_topic(create_equation_dict(package_variables(data_dict), data_dict))
+    try:
+        return apply_limits(topic, always=True)
+    except estimate.GenerationTooLarge as err:
+        return {'error': str(err)}
+
+
+def problem_writer(topic_doc, generation=None):
+    """
+    Return a writer for the problems of topic_doc in generation, its
+    current one by default: a CompactWriter if it's stored compactly or
+    else a ProblemWriter, configured from the app config.
+    """
+
+    generation = topic_doc.generation if generation is None else generation
+    if topic_doc.storage == 'compact':
+        return CompactWriter(topic_doc.id, storage.variables_of(topic_doc),
+                             batch_size=current_app.config['PROBLEM_BLOCK_SIZE'],
+                             write_ahead=current_app.config['PROBLEM_WRITE_AHEAD'],
+                             generation=generation)
+
+    return ProblemWriter(topic_doc.id,
+                         batch_size=current_app.config['PROBLEM_BATCH_SIZE'],
+                         write_ahead=current_app.config['PROBLEM_WRITE_AHEAD'],
+                         generation=generation)
+
+
+def save_problems(topic_doc, problems, generation=None):
+    """Write problems for topic_doc, in their order, see problem_writer."""
+
+    with problem_writer(topic_doc, generation) as writer:
+        writer.add(problems)
+
+
+def profile_path(data_dict):
+    """Return where to save a profile of this generation, if the form asked for one."""
+
+    if 'profile' not in data_dict:
+        return None
+
+    os.makedirs(current_app.config['PROFILE_DIR'], exist_ok=True)
+    return os.path.join(current_app.config['PROFILE_DIR'],
+                        f'{datetime.utcnow():%Y%m%d-%H%M%S-%f}.prof')
+
+
+def generation_stats(recorded, path, cost=None):
+    """
+    Summarize the metrics recorded for a topic, and the cost predicted
+    for it if any, if TOPIC_STATS is on.
+    """
+
+    if not current_app.config['TOPIC_STATS']:
+        return None
+
+    stats = recorded.summary()
+    if path is not None:
+        stats['profile'] = path
+    if cost is not None:
+        stats['estimate'] = cost
+
+    return stats
+
+
+def build_topic(data_dict, progress=None):
+    """
+    Get equation info, generate problems and write result to db.
+    progress is passed on to Topic.generate_problems.
+    """
 
-    utilities.start_logging()
     # Identify all valid problem combinations
     var_docs = package_variables(data_dict)
     eq_dict = create_equation_dict(var_docs, data_dict)
-    topic = Topic(eq_dict)
-    topic.generate_problems()
-    logging.info(topic.dict)
+    topic = make_topic(eq_dict)
 
-    # Save to Topics database with mongoengine
-    logging.info('Sending to the databases.')
-    topic_doc = Topics(**topic.dict)
+    # Save the topic first, so its problems can be written as they're solved
+    topic_doc = Topics(**{k: v for k, v in topic.dict.items() if k != 'problems'},
+                       storage=current_app.config['PROBLEM_STORAGE'])
     topic_doc.save()
-    logging.info(f'Saved {topic_doc.topic} to the database.')
+
+    # Reuse the problems if this equation was already generated with the
+    # same parameters; only the topic's metadata is new. Otherwise check
+    # the topic is within limits first, which may turn it into a sample.
+    path = profile_path(data_dict)
+    cost = None
+    try:
+        with problem_writer(topic_doc) as writer, metrics.collect() as recorded,\
+             metrics.profile(path), metrics.timed('generation_seconds'):
+            key = cache.cache_key(topic)
+            cached = cache.get(key)
+            if cached is None:
+                cost = apply_limits(topic)
+                if cost is not None and 'sample_size' in cost['adapted']:
+                    key = cache.cache_key(topic)
+                topic.generate_problems(progress, sink=writer.add)
+            else:
+                reuse_problems(topic, *cached)
+                writer.add(topic.dict['problems'])
+                if progress is not None:
+                    progress(1, 1, len(topic.dict['problems']))
+    except Exception:
+        # Don't leave a topic with only some of its problems behind
+        topic_doc.delete()
+        raise
+    metrics.inc('topics_generated')
+    if cached is None:
+        cache.put(key, topic.equation, topic.dict['problems'], topic_doc)
+
+    topic_doc.update(set__sample_size=topic.dict.get('sample_size'),
+                     set__seed=topic.dict.get('seed'),
+                     set__stats=generation_stats(recorded, path, cost))
+    logging.info('Saved %s (%s, %d problems) to the database.',
+                 topic_doc.topic, topic_doc.equation, len(topic.dict['problems']))
+
+    return topic_doc.id
+
+
+def update_topic(topic_id, data_dict, progress=None):
+    """
+    Change the variable ranges of a saved topic to those in data_dict. The
+    saved problems are patched when possible, so only combinations outside
+    the old ranges get solved. progress is passed on to the Topic.
+    """
+
+    topic_doc = Topics.objects.get(id=topic_id)
+    var_docs = package_variables(data_dict)
+    old_variables = [var.to_mongo().to_dict() for var in topic_doc.variables]
+    if [var['variable'] for var in var_docs] != [var['variable'] for var in old_variables]:
+        raise ValueError("A topic's variables can't change, only their ranges.")
+
+    eq_dict = {key: topic_doc[key] for key in
+               ('equation', 'topic', 'instructions', 'categories', 'positive_only',
+                'sample_size', 'seed')}
+    eq_dict['variables'] = var_docs
+    topic = make_topic(eq_dict)
+
+    path = profile_path(data_dict)
+    cost = None
+    with metrics.collect() as recorded, metrics.profile(path), metrics.timed('generation_seconds'):
+        key = cache.cache_key(topic)
+        cached = cache.get(key)
+        if cached is None:
+            # Held to the limits as if generated from scratch, since it may be
+            cost = apply_limits(topic)
+            if cost is not None and 'sample_size' in cost['adapted']:
+                key = cache.cache_key(topic)
+            old_problems = storage.read_problems(topic_doc)
+            if not topic.update_problems(old_variables, old_problems, progress):
+                logging.info('Regenerating all problems.')
+                topic.generate_problems(progress)
+        else:
+            reuse_problems(topic, *cached)
+            if progress is not None:
+                progress(1, 1, len(topic.dict['problems']))
+    metrics.inc('topics_generated')
+
+    # Write the new problems next to the old ones, then switch the topic
+    # to them and its new ranges in one update, so readers see one set or
+    # the other. A failed write leaves the topic as it was.
+    generation = topic_doc.generation + 1
+    storage.delete_problems(topic_doc, generation) # Left by an update that died
+    try:
+        save_problems(topic_doc, topic.dict['problems'], generation)
+    except Exception:
+        storage.delete_problems(topic_doc, generation)
+        raise
+
+    cache.forget(topic_doc)
+    topic_doc.update(set__variables=[Variables(**var) for var in var_docs],
+                     set__sample_size=topic.dict.get('sample_size'),
+                     set__seed=topic.dict.get('seed'),
+                     set__stats=generation_stats(recorded, path, cost),
+                     set__generation=generation)
+    storage.delete_problems(topic_doc, generation - 1)
+    if cached is None:
+        cache.put(key, topic.equation, topic.dict['problems'], topic_doc)
+    logging.info('Updated the ranges of %s, now %d problems.',
+                 topic_doc.topic, len(topic.dict['problems']))
 
     return topic_doc.id
@@ -0,0 +1,171 @@
+"""
+Runs build_topic, update_topic and batches of topics in the background. Every run is tracked by a document in
+the Jobs collection, so its status and progress survive the request that
+submitted it and can be polled from /results.
+"""
+
+# pylint: disable=W0212, W0603, W0703
+
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.datastructures import MultiDict
+from app import batch, generator
+from app.models import Jobs
+
+
+# Shared by all requests in this process; its size caps the number of
+# topics generated at the same time. Created on first use.
+executor = None
+
+# The process the solver was last warmed up in, see warm_up()
+warm_pid = None
+
+
+class JobCancelled(Exception):
+    """The job was cancelled while it was running."""
+
+
+def get_executor():
+    """Return the job pool, creating it with JOB_WORKERS threads."""
+
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=current_app.config['JOB_WORKERS'])
+
+    return executor
+
+
+def warm_up():
+    """
+    Get the solver ready in a background thread, once per process. Runs
+    before every request, so each server worker warms up after it's forked
+    instead of paying for sympy at import or on its first generation.
+    """
+
+    global warm_pid
+    if warm_pid == os.getpid() or not current_app.config['WARM_UP']:
+        return
+
+    warm_pid = os.getpid()
+    threading.Thread(target=run_warm_up, args=(current_app._get_current_object(),),
+                     daemon=True).start()
+
+
+def run_warm_up(app):
+    """Run generator.warm_up, logging rather than raising any error."""
+
+    start = time.perf_counter()
+    with app.app_context():
+        try:
+            generator.warm_up()
+        except Exception:
+            logging.exception('Warm-up failed.')
+            return
+
+    logging.info('Warmed up the solver in %.2fs.', time.perf_counter() - start)
+
+
+def submit(form, topic_id=None):
+    """
+    Queue build_topic for the submitted form and return the job id. Given
+    a topic_id, queue update_topic for that topic instead.
+    """
+
+    job = Jobs(form=form.to_dict(flat=False), topic_id=topic_id)
+    job.save()
+
+    get_executor().submit(run_job, current_app._get_current_object(), job.id)
+    logging.info('Queued job %s.', job.id)
+
+    return job.id
+
+
+def run_job(app, job_id):
+    """Run a pending job to completion, recording the outcome on it."""
+
+    with app.app_context():
+        # Claim the job atomically, so it runs once and never after a cancel
+        job = Jobs.objects(id=job_id, status='pending').modify(new=True, set__status='running')
+        if job is None:
+            return
+
+        form = MultiDict(job.form)
+        progress = functools.partial(report_progress, job)
+        try:
+            if job.topic_id is None:
+                topic_id = generator.build_topic(form, progress=progress)
+            else:
+                topic_id = generator.update_topic(job.topic_id, form, progress=progress)
+        except JobCancelled:
+            logging.info('Cancelled job %s.', job_id)
+            return
+        except Exception as err:
+            logging.exception('Job %s failed.', job_id)
+            job.update(set__status='failed', set__error=str(err))
+            return
+
+        Jobs.objects(id=job_id, status='running').update_one(set__status='done',
+                                                             set__topic_id=topic_id)
+
+
+def submit_batch(specs):
+    """Queue a batch of specs, already validated, and return the job id."""
+
+    job = Jobs(form={'specs': specs}, batch=True)
+    job.save()
+
+    get_executor().submit(run_batch_job, current_app._get_current_object(), job.id)
+    logging.info('Queued batch job %s of %d specs.', job.id, len(specs))
+
+    return job.id
+
+
+def run_batch_job(app, job_id):
+    """Run a pending batch job to completion, recording a result per spec on it."""
+
+    with app.app_context():
+        job = Jobs.objects(id=job_id, status='pending').modify(new=True, set__status='running')
+        if job is None:
+            return
+
+        try:
+            results = batch.run(job.form['specs'],
+                                progress=functools.partial(report_progress, job, unit='topics'))
+        except JobCancelled:
+            logging.info('Cancelled job %s.', job_id)
+            return
+        except Exception as err:
+            logging.exception('Job %s failed.', job_id)
+            job.update(set__status='failed', set__error=str(err))
+            return
+
+        Jobs.objects(id=job_id, status='running').update_one(set__status='done',
+                                                             set__results=results)
+
+
+def report_progress(job, chunks_done, chunks_total, problems, unit='chunks'):
+    """
+    Record a running job's progress, counted in unit, then stop it if it
+    was cancelled.
+    """
+
+    job.update(set__chunks_done=chunks_done,
+               set__chunks_total=chunks_total,
+               set__problems=problems,
+               set__unit=unit)
+
+    job.reload('status')
+    if job.status == 'cancelled':
+        raise JobCancelled
+
+
+def cancel(job_id):
+    """Cancel a pending or running job. Return False if it already ended."""
+
+    return Jobs.objects(id=job_id, status__in=('pending', 'running'))\
+               .update_one(set__status='cancelled') == 1
@@ -0,0 +1,216 @@
+"""
+Counters and histograms for the generation pipeline, rendered in the
+Prometheus text format on /metrics. Code running inside collect() also
+records into a registry of its own, which becomes the generation stats
+saved on a topic.
+"""
+
+import cProfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Every metric, as name: (type, help). Names get PREFIX when rendered.
+METRICS = {
+    'combinations_evaluated': ('counter', 'Combinations of input values solved.'),
+    'combinations_pruned': ('counter', 'Combinations ruled out before solving.'),
+    'solveset_calls': ('counter', 'Combinations solved individually with solveset.'),
+    'valid_problems': ('counter', 'Valid problems found.'),
+    'topics_generated': ('counter', 'Topics generated or updated.'),
+    'cache_lookups': ('counter', 'Problem cache lookups, by layer and result.'),
+    'shape_cache_lookups': ('counter', 'Equation shape cache lookups, by result.'),
+    'stage_seconds': ('histogram', 'Time spent in each stage of the pipeline.'),
+    'generation_seconds': ('histogram', 'Time to generate the problems of a topic.'),
+}
+PREFIX = 'generator_'
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+
+class Registry():
+    """
+    Store counter values and histogram buckets, keyed by metric name and
+    labels. Safe to share between threads.
+        counters: {(name, labels): value}
+        histograms: {(name, labels): [count per bucket..., +Inf count, sum]}
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+
+    def inc(self, key, amount=1):
+        """Add amount to a counter."""
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+
+    def observe(self, key, value):
+        """Record value in a histogram."""
+
+        with self.lock:
+            histogram = self.histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+
+
+    def snapshot(self):
+        """Return a picklable copy of the registry, for merge()."""
+
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'histograms': {key: list(value) for key, value in self.histograms.items()}}
+
+
+    def merge(self, snapshot):
+        """Add the values of a snapshot from another registry."""
+
+        with self.lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, value in snapshot['histograms'].items():
+                histogram = self.histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+                for i, count in enumerate(value):
+                    histogram[i] += count
+
+
+    def summary(self):
+        """Return counters and time per stage as a plain dict, e.g. for Mongo."""
+
+        summary = {'counters': {}, 'stages': {}}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                label = '_'.join(str(label_value) for _, label_value in labels)
+                summary['counters'][f'{name}_{label}' if label else name] = value
+            for (name, labels), histogram in self.histograms.items():
+                stage = dict(labels).get('stage', name)
+                summary['stages'][stage] = {'count': histogram[-2], 'seconds': histogram[-1]}
+
+        return summary
+
+
+    def render(self):
+        """Render the registry in the Prometheus text format."""
+
+        def format_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+        lines = []
+        with self.lock:
+            for name, (kind, description) in METRICS.items():
+                lines.append(f'# HELP {PREFIX}{name} {description}')
+                lines.append(f'# TYPE {PREFIX}{name} {kind}')
+                if kind == 'counter':
+                    for (key, labels), value in sorted(self.counters.items()):
+                        if key == name:
+                            lines.append(f'{PREFIX}{name}_total{format_labels(labels)} {value}')
+                    continue
+
+                for (key, labels), histogram in sorted(self.histograms.items()):
+                    if key != name:
+                        continue
+                    for bound, count in zip(BUCKETS, histogram):
+                        bucket = format_labels(labels, [('le', bound)])
+                        lines.append(f'{PREFIX}{name}_bucket{bucket} {count}')
+                    bucket = format_labels(labels, [('le', '+Inf')])
+                    lines.append(f'{PREFIX}{name}_bucket{bucket} {histogram[-2]}')
+                    lines.append(f'{PREFIX}{name}_sum{format_labels(labels)} {histogram[-1]}')
+                    lines.append(f'{PREFIX}{name}_count{format_labels(labels)} {histogram[-2]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# Everything recorded in this process, as served on /metrics
+registry = Registry()
+
+# The registry of the collect() block running in each thread, if any
+local = threading.local()
+
+
+def make_key(name, labels):
+    """Key a metric by name and sorted labels."""
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """Add amount to a counter."""
+
+    key = make_key(name, labels)
+    registry.inc(key, amount)
+    collector = getattr(local, 'collector', None)
+    if collector is not None:
+        collector.inc(key, amount)
+
+
+def observe(name, value, **labels):
+    """Record value in a histogram."""
+
+    key = make_key(name, labels)
+    registry.observe(key, value)
+    collector = getattr(local, 'collector', None)
+    if collector is not None:
+        collector.observe(key, value)
+
+
+def merge(snapshot):
+    """Add a snapshot recorded elsewhere, e.g. in a worker process."""
+
+    registry.merge(snapshot)
+    collector = getattr(local, 'collector', None)
+    if collector is not None:
+        collector.merge(snapshot)
+
+
+@contextmanager
+def timed(name, **labels):
+    """Record the time spent in the block in a histogram."""
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+@contextmanager
+def collect():
+    """Also record everything in the block, in this thread, in a new Registry."""
+
+    previous = getattr(local, 'collector', None)
+    local.collector = Registry()
+    try:
+        yield local.collector
+    finally:
+        local.collector = previous
+
+
+@contextmanager
+def profile(path):
+    """
+    Profile the block with cProfile and dump the stats to path, for
+    pstats or snakeviz. Does nothing if path is None. Only this thread is
+    profiled, so work done in a process pool doesn't show up.
+    """
+
+    if path is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -1,8 +1,11 @@
 """mongoengine models"""
 
+from datetime import datetime
 from mongoengine import Document, EmbeddedDocument
 from mongoengine import StringField, ListField,BooleanField, DictField,\
-                        EmbeddedDocumentField, IntField
+                        EmbeddedDocumentField, IntField, FloatField, ObjectIdField,\
+                        DateTimeField, ReferenceField, BinaryField, CASCADE
+from app.number_types import NUM_TYPES
 
 
 class Variables(EmbeddedDocument):
@@ -10,30 +13,94 @@ class Variables(EmbeddedDocument):
     min = IntField(required=True)
     max = IntField(required=True)
     zero_ok = BooleanField()
-    num_type = StringField(max_length=1)
+    num_type = StringField(max_length=1, choices=tuple(NUM_TYPES))
+    precision = IntField(min_value=1) # Largest denominator or decimal places
 
     def __unicode__(self):
         return self.variable
 
 
-class Problems(EmbeddedDocument):
-    values = DictField(required=True)
-    problem = StringField(max_length=255, required=True)
-    answer = StringField(max_length=255, required=True)
-
-
 class Topics(Document):
     topic = StringField(max_length=255, required=True)
     instructions = StringField(max_length=255, required=True)
     categories = ListField(StringField(max_length=50), required=True)
     integers_only = BooleanField()
     positive_only = BooleanField()
+    sample_size = IntField() # Number of problems drawn at random, if not all
+    seed = IntField()
     equation = StringField(max_length=255, required=True)
     variables = ListField(EmbeddedDocumentField(Variables), required=True)
-    problems = ListField(EmbeddedDocumentField(Problems), required=True)
+    stats = DictField() # Generation metrics, if TOPIC_STATS is on
+    storage = StringField(max_length=20, default='documents',
+                          choices=('documents', 'compact')) # Where the problems are
+    generation = IntField(default=0) # Which set of problems is current, see storage.py
 
     def __unicode__(self):
         return self.topic
 
     def __repr__(self):
         return self.topic
+
+
+class ProblemFeatures(EmbeddedDocument):
+    answers = IntField(required=True) # Number of answers
+    answer_min = FloatField() # Smallest and largest answer, if there are any
+    answer_max = FloatField()
+    answer_size = FloatField() # Largest absolute answer
+    negatives = BooleanField() # Whether any given value is negative
+    coefficient_size = FloatField() # Largest absolute given value
+
+
+class Problems(Document):
+    topic = ReferenceField(Topics, required=True, reverse_delete_rule=CASCADE)
+    position = IntField(required=True) # Order within the topic
+    generation = IntField(default=0) # Set of problems it belongs to
+    values = DictField(required=True)
+    problem = StringField(max_length=255, required=True)
+    answer = StringField(max_length=255, required=True)
+    features = EmbeddedDocumentField(ProblemFeatures) # See app/features.py
+
+    meta = {'indexes': [{'fields': ['topic', 'generation', 'position'], 'unique': True},
+                        ('topic', 'values'),
+                        ('topic', 'answer'),
+                        ('topic', 'features.answers', 'features.answer_max'),
+                        ('topic', 'features.coefficient_size')]}
+
+
+class ProblemBlocks(Document):
+    topic = ReferenceField(Topics, required=True, reverse_delete_rule=CASCADE)
+    position = IntField(required=True) # Position of the block's first problem
+    generation = IntField(default=0) # Set of problems it belongs to
+    count = IntField(required=True)
+    data = BinaryField(required=True) # See app/compact.py
+
+    meta = {'indexes': [{'fields': ['topic', 'generation', 'position'], 'unique': True}]}
+
+
+class ProblemCache(Document):
+    key = StringField(max_length=64, required=True, unique=True)
+    equation = StringField(max_length=255, required=True)
+    topic = ReferenceField(Topics, required=True,
+                           reverse_delete_rule=CASCADE) # Whose problems are reused
+
+
+class Jobs(Document):
+    status = StringField(max_length=20, required=True, default='pending',
+                         choices=('pending', 'running', 'done', 'failed', 'cancelled'))
+    form = DictField(required=True)
+    topic_id = ObjectIdField() # The topic to update, or the one generated
+    chunks_done = IntField(default=0)
+    chunks_total = IntField(default=0)
+    unit = StringField(max_length=20, default='chunks') # What chunks_done counts
+    problems = IntField(default=0)
+    error = StringField()
+    created = DateTimeField(default=datetime.utcnow)
+    # Batch jobs count topics rather than chunks, and record a result per spec
+    batch = BooleanField(default=False)
+    results = ListField(DictField())
+
+    def __unicode__(self):
+        return str(self.id)
+
+    def __repr__(self):
+        return str(self.id)
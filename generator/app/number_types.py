@@ -0,0 +1,121 @@
+"""
+The kinds of numbers a variable can take, set by its num_type: integers,
+fractions up to a largest denominator, or decimals with a number of
+places. Values are enumerated and checked as exact Fractions, and stored
+as ints for integers and as strings like '3/4' or '0.25' otherwise.
+"""
+
+import itertools
+import math
+from fractions import Fraction
+
+
+# num_type: label
+NUM_TYPES = {'i': 'Integer',
+             'f': 'Fraction',
+             'd': 'Decimal'}
+
+# Largest denominator for fractions and number of places for decimals,
+# when a variable doesn't set its precision
+DEFAULT_PRECISION = {'f': 10,
+                     'd': 1}
+
+
+def num_type(var):
+    """Return the num_type of var, a variable dict."""
+    return var.get('num_type') or 'i'
+
+
+def precision(var):
+    """Return the precision of var, or None for integers."""
+
+    if num_type(var) == 'i':
+        return None
+    return int(var.get('precision') or DEFAULT_PRECISION[num_type(var)])
+
+
+def is_integer(variables):
+    """Whether all of variables are integers, which the faster solvers require."""
+    return all(num_type(var) == 'i' for var in variables)
+
+
+def value_range(var):
+    """List the values of var from its min to its max, in order."""
+
+    low, high = int(var['min']), int(var['max'])
+    if num_type(var) == 'i':
+        return list(range(low, high + 1))
+
+    if num_type(var) == 'd':
+        scale = 10 ** precision(var)
+        return [Fraction(n, scale) for n in range(low * scale, high * scale + 1)]
+
+    values = set()
+    for denominator in range(1, precision(var) + 1):
+        values.update(Fraction(n, denominator)
+                      for n in range(low * denominator, high * denominator + 1))
+    return sorted(values)
+
+
+def count_coprime(start, stop, denominator):
+    """Count the integers from start to stop that share no factor with denominator."""
+
+    primes = [p for p in range(2, denominator + 1)
+              if denominator % p == 0 and all(p % q for q in range(2, p))]
+    count = 0
+    for size in range(len(primes) + 1):
+        for factors in itertools.combinations(primes, size):
+            step = math.prod(factors)
+            count += (-1) ** size * (stop // step - (start - 1) // step)
+    return count
+
+
+def count_values(var):
+    """Count the values value_range lists for var, without listing them."""
+
+    low, high = int(var['min']), int(var['max'])
+    if low > high:
+        return 0
+    if num_type(var) == 'i':
+        return high - low + 1
+    if num_type(var) == 'd':
+        return (high - low) * 10 ** precision(var) + 1
+
+    # Each fraction once, in lowest terms
+    return sum(count_coprime(low * denominator, high * denominator, denominator)
+               for denominator in range(1, precision(var) + 1))
+
+
+def parse(value):
+    """Turn a stored value back into a Fraction, or leave an int alone."""
+    return value if isinstance(value, int) else Fraction(value)
+
+
+def format_value(var, value):
+    """Return value, a Fraction or int of var's num_type, as it's stored."""
+
+    if num_type(var) == 'i':
+        return int(value)
+
+    value = Fraction(value)
+    if value.denominator == 1:
+        return str(value.numerator)
+    if num_type(var) == 'f':
+        return str(value)
+
+    # Decimals terminate, so the digits are exact
+    sign = '-' if value < 0 else ''
+    scale = 10 ** precision(var)
+    whole, part = divmod(abs(value.numerator) * scale // value.denominator, scale)
+    digits = str(part).rjust(precision(var), '0').rstrip('0')
+    return f'{sign}{whole}.{digits}'
+
+
+def substitution(value):
+    """Return a stored value as text for rendering.render_problem to substitute."""
+
+    value = str(value)
+    if '/' in value:
+        numerator, denominator = value.split('/')
+        return f'Rational({numerator},{denominator})'
+    return value
@@ -0,0 +1,90 @@
+"""
+Spreads a Topic's generation pipeline across a pool of processes.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from app import metrics
+
+
+# Each worker process builds its own Topic once, in init_worker, so the
+# equation is parsed and solved symbolically once per process and only
+# row bounds and finished problems cross the process boundary.
+worker_state = {}
+
+# Number of chunks queued per worker, which bounds the memory held by
+# results waiting to be merged.
+CHUNKS_PER_WORKER = 2
+
+
+def init_worker(topic_class, equation_dict, options):
+    """Parse the equation and compile its solver once per worker."""
+
+    topic = topic_class(equation_dict, **options)
+    prepped_equation = topic.prep_equation()
+    topic.compile_solver(prepped_equation)
+
+    worker_state['topic'] = topic
+    worker_state['prepped_equation'] = prepped_equation
+    worker_state['var_ranges'] = topic.generate_var_ranges()
+
+
+def solve_slice(bounds):
+    """
+    Solve rows bounds[0] to bounds[1] of the worker's topic. Return the
+    valid problems, the number of combinations pruned and a snapshot of
+    the metrics recorded meanwhile.
+    """
+
+    topic = worker_state['topic']
+    var_ranges = worker_state['var_ranges']
+    pruned = topic.pruned
+    with metrics.collect() as recorded:
+        chunk = topic.generate_input_slice(var_ranges, *bounds)
+        valid_combos = topic.solve_chunk(worker_state['prepped_equation'], var_ranges, chunk)
+
+    return valid_combos, topic.pruned - pruned, recorded.snapshot()
+
+
+def collect(topic, future):
+    """
+    Return the problems solved by future, counting its pruned combinations
+    and merging its metrics into this process.
+    """
+
+    valid_combos, pruned, recorded = future.result()
+    topic.pruned += pruned
+    metrics.merge(recorded)
+    return valid_combos
+
+
+def solve_chunks(topic):
+    """
+    Yield the topic's solved chunks in the same order as Topic.solve_chunks,
+    while topic.workers processes solve the chunks ahead of time. The
+    workers' pruned counts are added to topic.pruned and their metrics to
+    this process.
+    """
+
+    options = {'engine': topic.engine,
+               'chunk_size': topic.chunk_size,
+               'max_problems': topic.max_problems,
+               'prune': topic.prune}
+    equation_dict = {k: v for k, v in topic.dict.items() if k != 'problems'}
+    executor = ProcessPoolExecutor(max_workers=topic.workers,
+                                   initializer=init_worker,
+                                   initargs=(type(topic), equation_dict, options))
+
+    try:
+        pending = deque()
+        for bounds in topic.generate_chunk_bounds(topic.generate_var_ranges()):
+            pending.append(executor.submit(solve_slice, bounds))
+            if len(pending) >= topic.workers * CHUNKS_PER_WORKER:
+                yield collect(topic, pending.popleft())
+
+        while pending:
+            yield collect(topic, pending.popleft())
+
+    finally:
+        # Drop queued chunks if the caller stopped early
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,143 @@
+"""
+Writes a topic's problems to the Problems collection in batches while they
+are still being generated. Batches go out as unordered bulk inserts on a
+background thread, so database I/O overlaps with solving. Topics stored
+compactly get one ProblemBlocks document per batch instead.
+"""
+
+# pylint: disable=W0212
+
+from concurrent.futures import ThreadPoolExecutor
+from bson import Binary
+from app import compact, features, metrics
+from app.models import Problems, ProblemBlocks
+
+
+class ProblemWriter():
+    """
+    Collect problems for one topic and insert them batch_size at a time.
+    At most write_ahead batches wait to be written; add() blocks on the
+    oldest one beyond that, so memory stays flat when Mongo is slower than
+    the solver. Use as a context manager, or call close() at the end.
+        generation: The topic's set of problems they belong to, see
+            storage.py.
+        batch: Problems not yet sent, with their topic and position set.
+        pending: Futures of the batches being written, oldest first.
+    """
+
+    def __init__(self, topic_id, batch_size=1000, write_ahead=4, generation=0):
+        self.topic_id = topic_id
+        self.generation = generation
+        self.batch_size = batch_size
+        self.write_ahead = write_ahead
+        self.collection = Problems._get_collection()
+        self.position = 0
+        self.batch = []
+        self.pending = []
+        self.checked = False
+
+        # One thread, so the batches are inserted in the order they were added
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+    def check(self, problem):
+        """
+        Validate problem against the Problems schema. Every problem of a
+        topic has the same shape, so only the first one is checked and the
+        rest skip mongoengine entirely.
+        """
+
+        Problems(topic=self.topic_id, position=self.position, generation=self.generation,
+                 **problem).validate()
+        self.checked = True
+
+
+    def add(self, problems):
+        """Queue problems to be written after those already added."""
+
+        # Problems cached before features existed get them on the way in
+        features.add_features(problems)
+        if problems and not self.checked:
+            self.check(problems[0])
+
+        for problem in problems:
+            self.batch.append(dict(problem, topic=self.topic_id, position=self.position,
+                                   generation=self.generation))
+            self.position += 1
+            if len(self.batch) >= self.batch_size:
+                self.flush()
+
+
+    def flush(self):
+        """Send the current batch to the writer thread."""
+
+        if not self.batch:
+            return
+
+        self.pending.append(self.executor.submit(self.write, self.batch))
+        self.batch = []
+        while len(self.pending) > self.write_ahead:
+            self.pending.pop(0).result()
+
+
+    def write(self, batch):
+        """Insert one batch. Runs on the writer thread."""
+
+        with metrics.timed('stage_seconds', stage='write_batch'):
+            self.collection.insert_many(batch, ordered=False)
+
+
+    def close(self):
+        """Write what's left and wait for every batch, raising any error."""
+
+        self.flush()
+        try:
+            while self.pending:
+                self.pending.pop(0).result()
+        finally:
+            self.executor.shutdown()
+
+
+    def abort(self):
+        """Drop what's left and wait for the batches already sent, ignoring errors."""
+
+        self.batch = []
+        for future in self.pending:
+            future.cancel()
+        self.executor.shutdown()
+        self.pending = []
+
+
+class CompactWriter(ProblemWriter):
+    """
+    Like ProblemWriter, but write each batch as one ProblemBlocks document
+    holding the batch's values packed by compact.encode.
+        variables: The topic's variables, as dicts, the answer last.
+    """
+
+    def __init__(self, topic_id, variables, batch_size=10000, write_ahead=4, generation=0):
+        super().__init__(topic_id, batch_size, write_ahead, generation)
+        self.variables = variables
+        self.collection = ProblemBlocks._get_collection()
+
+
+    def write(self, batch):
+        """Pack and insert one batch. Runs on the writer thread."""
+
+        with metrics.timed('stage_seconds', stage='write_batch'):
+            self.collection.insert_one({'topic': self.topic_id,
+                                        'position': batch[0]['position'],
+                                        'generation': self.generation,
+                                        'count': len(batch),
+                                        'data': Binary(compact.encode(batch, self.variables))})
@@ -0,0 +1,124 @@
+"""
+Rules out combinations of input values before they're solved, using the
+structure of the equation: whether its roots divide out to integers,
+whether they're real, and whether they fall in the answer variable's
+range. Only combinations that provably can't be valid are eliminated, so
+pruning never changes the problems generated.
+"""
+
+# pylint: disable=C0103
+
+import numpy as np
+from sympy import Poly, lambdify
+from app.vectorized import INT_BOUND
+
+
+class Pruner():
+    """
+    Store the coefficients of a linear or quadratic equation in its answer
+    variable as integer polynomials of the input variables.
+        degree: Degree of the equation in the answer variable.
+        polys: Coefficients of the numerator, highest degree first, then
+            the denominator and, for quadratics, the discriminant.
+        bounds: (sum of absolute coefficients, total degree) for each of
+            polys, used to guard the int64 evaluations against overflow.
+    """
+
+    def __init__(self, params, polys, degree):
+        self.degree = degree
+        self.polys = polys
+        self.functions = [lambdify(params, poly.as_expr(), modules='numpy') for poly in polys]
+        self.bounds = [(sum(abs(int(coeff)) for coeff in poly.coeffs()), poly.total_degree())
+                       for poly in polys]
+
+
+    @classmethod
+    def compile(cls, closed_form):
+        """
+        Build a Pruner from a ClosedForm. Return None when the answer
+        variable appears in the denominator, as a root might then cancel
+        out, or when there are no input variables to prune.
+        """
+
+        params, x = closed_form.symbols[:-1], closed_form.symbols[-1]
+        numerator, denominator = closed_form.polys
+        if not params or denominator.degree(x) > 0:
+            return None
+
+        coeffs = Poly(numerator.as_expr(), x).all_coeffs()
+        polys = [Poly(coeff, *params) for coeff in coeffs]
+        polys.append(Poly(denominator.as_expr(), *params))
+        if len(coeffs) == 3:
+            a, b, c = coeffs
+            polys.append(Poly(b**2 - 4*a*c, *params))
+
+        return cls(params, polys, len(coeffs) - 1)
+
+
+    def evaluate(self, columns):
+        """
+        Evaluate self.polys for every row of columns. Return the values and
+        a mask of the rows where int64 is safe; other rows evaluate to 0.
+        """
+
+        size = len(columns[0])
+        magnitude = np.ones(size)
+        for column in columns:
+            magnitude = np.maximum(magnitude, np.abs(column).astype(float))
+        safe = ~np.logical_or.reduce([coeff_sum * magnitude**degree > INT_BOUND
+                                      for coeff_sum, degree in self.bounds])
+
+        columns = [np.where(safe, column, 0) for column in columns]
+        values = [np.broadcast_to(function(*columns), (size,)).astype(np.int64)
+                  for function in self.functions]
+        return values, safe
+
+
+    def eliminate(self, columns, answer_values, positive_only):
+        """
+        Return a mask of the rows of columns, one int64 array per input
+        variable, that can't produce a valid problem. Rows where the
+        leading coefficient or the denominator is zero are left alone, as
+        those are degenerate and settled by solveset.
+        """
+
+        values, safe = self.evaluate(columns)
+        leading, denominator = values[0], values[self.degree + 1]
+        candidates = safe & (leading != 0) & (denominator != 0)
+
+        if self.degree == 1:
+            return candidates & self.bad_root(-values[1], leading, answer_values, positive_only)
+
+        # Complex roots are never valid. Irrational roots are never valid
+        # either, unless positive_only might discard them as negatives.
+        b, discriminant = values[1], values[4]
+        root = np.sqrt(np.maximum(discriminant, 0).astype(float)).astype(np.int64)
+        for _ in range(2):
+            root = np.where(root * root > discriminant, root - 1, root)
+            root = np.where((root + 1) * (root + 1) <= discriminant, root + 1, root)
+        square = (discriminant >= 0) & (root * root == discriminant)
+
+        eliminated = discriminant < 0
+        if not positive_only:
+            eliminated |= ~square
+        for sign in (1, -1):
+            eliminated |= square & self.bad_root(-b + sign * root, 2 * leading,
+                                                 answer_values, positive_only)
+
+        return candidates & eliminated
+
+
+    def bad_root(self, numerator, denominator, answer_values, positive_only):
+        """
+        Flag rows where the rational root numerator / denominator makes the
+        combination invalid: it isn't an integer in answer_values, and with
+        positive_only, it's positive rather than discarded.
+        """
+
+        safe_denominator = np.where(denominator == 0, 1, denominator)
+        exact = numerator % safe_denominator == 0
+        bad = ~exact | ~np.isin(numerator // safe_denominator, answer_values)
+        if positive_only:
+            bad &= (numerator != 0) & ((numerator > 0) == (denominator > 0))
+
+        return bad
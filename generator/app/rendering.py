@@ -0,0 +1,265 @@
+"""
+Renders problems as LaTeX. Rendering through sympy costs a parse and a
+print per problem, so ProblemTemplates turns one rendering into a template
+that is then filled with plain string formatting.
+"""
+
+# pylint: disable=C0103
+
+import itertools
+import re
+from functools import lru_cache
+from sympy import preorder_traversal
+from sympy.parsing.sympy_parser import parse_expr,\
+                                       standard_transformations,\
+                                       implicit_multiplication_application
+from sympy.printing import latex
+
+
+# FYI: implicit_multiplication_application turns xyz into x*y*z
+TRANSFORMATIONS = standard_transformations + (implicit_multiplication_application,)
+
+# Numbers a value is always told apart from, besides the equation's own
+# literals, because the printer treats them specially (e.g. 1x, -1x, 0x).
+SPECIAL_NUMBERS = (0, 1)
+
+# Number of times each new template is checked against render_problem
+# before it's trusted.
+VERIFICATIONS = 2
+
+
+@lru_cache(maxsize=1024)
+def parse(expression, evaluate=True):
+    """Parse expression with TRANSFORMATIONS, remembering recent results."""
+    return parse_expr(expression, transformations=TRANSFORMATIONS, evaluate=evaluate)
+
+
+def render_problem(equation, input_vars, values):
+    """Substitute values for input_vars in equation and latexify it."""
+
+    # Sympy doesn't like equations, so this allows it to evaluate
+    # the left and right side independently
+    subbed_left_side = equation[:equation.find('=')]
+    subbed_right_side = equation[equation.find('=')+1:]
+
+    # Replace non-answer variables with values, all in one pass so values
+    # written with letters, like Rational(1,2), aren't substituted into
+    if input_vars:
+        substitutions = {variable: str(value) for variable, value in zip(input_vars, values)}
+        pattern = re.compile('|'.join(re.escape(variable) for variable in input_vars))
+        subbed_left_side = pattern.sub(lambda match: substitutions[match.group()],
+                                       subbed_left_side)
+        subbed_right_side = pattern.sub(lambda match: substitutions[match.group()],
+                                        subbed_right_side)
+
+    # Latexify each side of the equation, then concatenate
+    latex_left_side = latex(parse(subbed_left_side, evaluate=False))
+    latex_right_side = latex(parse(subbed_right_side, evaluate=False))
+
+    return str(latex_left_side) + ' = ' + str(latex_right_side)
+
+
+def compare(a, b):
+    """Return -1, 0 or 1 as a is less than, equal to or greater than b."""
+    return (a > b) - (a < b)
+
+
+class ProblemTemplates():
+    """
+    Store LaTeX templates for an equation's problems.
+
+    How sympy prints a problem depends on more than the values' digits:
+    signs, zeros and ones change the output, and so does the order of the
+    terms of a sum, which sympy sorts by their numbers. So values are
+    grouped into classes by their signs, by whether they're 0 or 1 in
+    size, and by how they compare with the numbers they're summed with.
+    Each class gets its own template, made by rendering its first problem
+    whose values can all be told apart in the output and replacing each
+    value's digits with a placeholder.
+        equation: User inputted equation.
+        input_vars: Variables to substitute, in the order of their values.
+        integers: Whether the values are ints. Other values are always
+            rendered through sympy.
+        templates: Class key -> list of strings and variable indexes, or
+            None for classes that can't be templated.
+        pairs: Pairs of numbers printed in an order that depends on their
+            values, see find_pairs.
+        rendered, filled: Problems rendered through sympy, and from a
+            template without checking.
+    """
+
+    def __init__(self, equation, input_vars, integers=True):
+        self.equation = equation
+        self.input_vars = input_vars
+        self.templates = {}
+        self.unverified = {}
+        self.rendered = 0
+        self.filled = 0
+
+        literals = set(SPECIAL_NUMBERS) | {int(n) for n in re.findall(r'\d+', equation)}
+        self.literals = sorted(literals | {-n for n in literals})
+
+        # Substituting digits next to a digit or another substituted
+        # variable merges them into a new number (2a -> 23), which
+        # templates can't follow.
+        letters = ''.join(input_vars)
+        self.enabled = integers and bool(letters) and '.' not in equation and not re.search(
+            f'[0-9{letters}][{letters}]|[{letters}][0-9]', equation)
+        self.pairs = self.find_pairs() if self.enabled else []
+
+
+    def find_pairs(self):
+        """
+        Return the pairs of numbers summed together in the equation,
+        counting each term's coefficient: sympy orders those by value.
+        Each number is ('value', index) or ('literal', int), and each pair
+        has at least one value. If the equation can't be parsed, every
+        pair of values is returned.
+        """
+
+        indexes = {variable: i for i, variable in enumerate(self.input_vars)}
+        values = [('value', i) for i in range(len(self.input_vars))]
+        try:
+            sides = [parse(side, evaluate=False) for side in self.equation.split('=')]
+        except (SyntaxError, TypeError, ValueError):
+            return list(itertools.combinations(values, 2))
+
+        def numbers(term):
+            if term.is_Mul:
+                return [number for factor in term.args for number in numbers(factor)]
+            if term.is_Symbol and term.name in indexes:
+                return [('value', indexes[term.name])]
+            if term.is_Integer:
+                return [('literal', int(term))]
+            return []
+
+        pairs = set()
+        for side in sides:
+            for node in preorder_traversal(side):
+                if not node.is_Add:
+                    continue
+                summed = [number for term in node.args for number in numbers(term)]
+                pairs |= {pair for pair in itertools.combinations(summed, 2)
+                          if 'value' in (pair[0][0], pair[1][0])}
+
+        return sorted(pairs)
+
+
+    def resolve(self, number, values):
+        """Return the int a number from find_pairs stands for, given values."""
+
+        kind, n = number
+        return values[n] if kind == 'value' else n
+
+
+    def class_key(self, values):
+        """
+        Describe what about values changes how they're printed: their
+        signs, which of them the printer treats specially, and how the
+        numbers summed together compare.
+        """
+
+        key = [(compare(value, 0), abs(value) if abs(value) in SPECIAL_NUMBERS else None)
+               for value in values]
+        for p, q in self.pairs:
+            p, q = self.resolve(p, values), self.resolve(q, values)
+            key.append((compare(p, q), compare(abs(p), abs(q)), compare(p, -q)))
+
+        return tuple(key)
+
+
+    def ambiguous(self, values):
+        """
+        Whether some value's digits can't be told apart from a literal's or
+        another value's in the output, so values can't make a template.
+        Numbers summed together that are equal in size are equal in every
+        problem of the class, so it doesn't matter which one is picked.
+        """
+
+        forced = {frozenset((p, q)) for p, q in self.pairs
+                  if abs(self.resolve(p, values)) == abs(self.resolve(q, values))}
+        numbers = [('value', i) for i, value in enumerate(values)
+                   if abs(value) not in SPECIAL_NUMBERS]
+        numbers += [('literal', literal) for literal in self.literals]
+        for p, q in itertools.combinations(numbers, 2):
+            if 'value' in (p[0], q[0]) and frozenset((p, q)) not in forced \
+               and abs(self.resolve(p, values)) == abs(self.resolve(q, values)):
+                return True
+
+        return False
+
+
+    def compile(self, values, rendered):
+        """
+        Turn the rendered problem for values into a template by replacing
+        the digits of each value with its index. Return None if some number
+        in the output can't be traced back to a literal or a value.
+        """
+
+        literals = {abs(literal) for literal in self.literals}
+        template = []
+        position = 0
+        for match in re.finditer(r'\d+', rendered):
+            number = int(match.group())
+            if number in literals:
+                continue
+
+            matches = [i for i, value in enumerate(values) if abs(value) == number]
+            if not matches:
+                return None
+
+            template.append(rendered[position:match.start()])
+            template.append(matches[0])
+            position = match.end()
+
+        template.append(rendered[position:])
+        return template
+
+
+    def render(self, values):
+        """Return the same LaTeX as render_problem for values."""
+
+        if not self.enabled:
+            return self.render_problem(values)
+
+        key = self.class_key(values)
+        if key not in self.templates:
+            if self.ambiguous(values):
+                return self.render_problem(values)
+            rendered = self.render_problem(values)
+            self.templates[key] = self.compile(values, rendered)
+            self.unverified[key] = VERIFICATIONS
+            return rendered
+
+        template = self.templates[key]
+        if template is None:
+            return self.render_problem(values)
+
+        filled = ''.join(part if isinstance(part, str) else str(abs(values[part]))
+                         for part in template)
+
+        # Check the first few uses of each template
+        if self.unverified[key]:
+            self.unverified[key] -= 1
+            rendered = self.render_problem(values)
+            if filled != rendered:
+                self.templates[key] = None
+                return rendered
+        else:
+            self.filled += 1
+
+        return filled
+
+
+    def render_problem(self, values):
+        """Render values through sympy, counting it."""
+
+        self.rendered += 1
+        return render_problem(self.equation, self.input_vars, values)
+
+
+    def hit_rate(self):
+        """Return the fraction of problems filled from a template without sympy."""
+
+        total = self.rendered + self.filled
+        return self.filled / total if total else None
@@ -0,0 +1,340 @@
+"""
+Shares the symbolic work behind a Topic's solver between topics with the
+same equation shape: the same parsed equation once its variables are
+renamed, so ax+b=c and my+n=k are one shape. The answer variable is
+renamed last, and the input variables in whichever order gives the
+smallest srepr, so the shape doesn't depend on their letters. Each shape
+is solved once per process, and the ClosedForm, RationalForm, GridSolver
+and Pruner compiled from that solution are built once and reused by every
+topic with it, each topic passing its inputs in the shape's order. With
+SHAPE_CACHE_PATH set, the symbolic solutions are also kept on disk, so
+they survive restarts and are shared between processes; the file is read
+on first use, and the compiled callables can't be pickled and are rebuilt.
+Parsing itself is memoized by rendering.parse.
+"""
+
+# pylint: disable=C0415, W0603
+
+import hashlib
+import itertools
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from app import metrics
+
+
+# Used until configure is called, e.g. outside the app
+DEFAULT_SIZE = 128
+
+# Equations with more input variables than this are renamed in the order
+# given instead of trying every order, which grows factorially
+MAX_REORDERED_INPUTS = 5
+
+
+def canonical_names(count):
+    """Return the names variables are renamed to, by position."""
+    return [f'v{i}' for i in range(count)]
+
+
+def shape_key(prepped_equation, variables):
+    """
+    Return (key, canonical equation, order) for prepped_equation, whose
+    variables are named in variables with the answer variable last. The
+    canonical equation renames the answer variable last and the input
+    variables in the order with the smallest srepr; order[i] is the index
+    in variables of the input renamed to the i-th canonical name. The key
+    hashes the canonical equation. Return (None, None, None) if the
+    equation has symbols that aren't variables, which no closed form allows.
+    """
+    from sympy import Symbol, srepr
+
+    symbols = [Symbol(name) for name in variables]
+    if not prepped_equation.free_symbols <= set(symbols):
+        return None, None, None
+
+    names = [Symbol(name) for name in canonical_names(len(variables))]
+    inputs = range(len(variables) - 1)
+    if len(inputs) > MAX_REORDERED_INPUTS:
+        orders = [tuple(inputs)]
+    else:
+        orders = itertools.permutations(inputs)
+
+    best = None
+    for order in orders:
+        renames = {symbols[i]: name for i, name in zip(order, names)}
+        renames[symbols[-1]] = names[-1]
+        canonical = prepped_equation.xreplace(renames)
+        text = srepr(canonical)
+        if best is None or text < best[0]:
+            best = (text, canonical, list(order))
+
+    text, canonical, order = best
+    return hashlib.sha256(text.encode()).hexdigest(), canonical, order
+
+
+class Reordered():
+    """
+    Pass a topic's input values to an object compiled for its shape, in
+    the shape's order. Values and columns are given in the topic's order.
+        order: For each of the shape's inputs, the index of the topic's.
+    """
+
+    def __init__(self, compiled, order):
+        self.compiled = compiled
+        self.order = order
+
+
+    def reorder(self, values):
+        """Return values, in the topic's order, in the shape's order."""
+        return [values[i] for i in self.order]
+
+
+    def solve(self, var_values):
+        """See ClosedForm.solve and RationalForm.solve."""
+        return self.compiled.solve(tuple(self.reorder(var_values)))
+
+
+    def classify(self, columns, answer_values, positive_only):
+        """See GridSolver.classify."""
+        return self.compiled.classify(self.reorder(columns), answer_values, positive_only)
+
+
+    def evaluate(self, columns):
+        """See Pruner.evaluate."""
+        return self.compiled.evaluate(self.reorder(columns))
+
+
+    def eliminate(self, columns, answer_values, positive_only):
+        """See Pruner.eliminate."""
+        return self.compiled.eliminate(self.reorder(columns), answer_values, positive_only)
+
+
+class Shape():
+    """
+    Store the symbolic solution of an equation shape and build what's
+    compiled from it on first use.
+        solution: The arguments of its ClosedForm, from
+            solver.solve_symbolically, or None if there's no closed form.
+        built: {name: compiled object} for those built so far.
+    """
+
+    def __init__(self, solution):
+        self.solution = solution
+        self.built = {}
+
+
+    def build(self, name, make):
+        """Return the object called name, calling make for it the first time."""
+
+        if name not in self.built:
+            self.built[name] = make()
+        return self.built[name]
+
+
+    def closed_form(self):
+        """Return the shape's ClosedForm, or None."""
+        from app.solver import ClosedForm
+
+        if self.solution is None:
+            return None
+        return self.build('closed_form', lambda: ClosedForm(*self.solution))
+
+
+    def rational_form(self):
+        """Return a RationalForm of the shape's closed form."""
+        from app.solver import RationalForm
+
+        return self.build('rational_form', lambda: RationalForm.compile(self.closed_form()))
+
+
+    def grid_solver(self):
+        """Return a GridSolver of the shape's closed form."""
+        from app.vectorized import GridSolver
+
+        return self.build('grid_solver', lambda: GridSolver(self.closed_form()))
+
+
+    def pruner(self):
+        """Return a Pruner of the shape's closed form, or None if it can't prune."""
+        from app.pruning import Pruner
+
+        return self.build('pruner', lambda: Pruner.compile(self.closed_form()))
+
+
+class TopicShape():
+    """
+    A Shape as seen by one topic, whose input variables may be in another
+    order. Has the same methods as Shape, returning objects that take the
+    topic's inputs in its own order.
+        order: See shape_key.
+    """
+
+    def __init__(self, shape, order):
+        self.shape = shape
+        self.order = order
+
+
+    def reordered(self, compiled):
+        """Return compiled, wrapped in Reordered unless the orders match."""
+
+        if compiled is None or self.order == sorted(self.order):
+            return compiled
+        return Reordered(compiled, self.order)
+
+
+    def closed_form(self):
+        """Return the shape's ClosedForm, or None."""
+        return self.reordered(self.shape.closed_form())
+
+
+    def rational_form(self):
+        """Return a RationalForm of the shape's closed form."""
+        return self.reordered(self.shape.rational_form())
+
+
+    def grid_solver(self):
+        """Return a GridSolver of the shape's closed form."""
+        return self.reordered(self.shape.grid_solver())
+
+
+    def pruner(self):
+        """Return a Pruner of the shape's closed form, or None if it can't prune."""
+        return self.reordered(self.shape.pruner())
+
+
+class ShapeCache():
+    """
+    Store the most recently used shapes, evicting the least recently used
+    one past max_entries, and keep their solutions in the file at path, if
+    any. The file is read on the first lookup rather than at boot, since
+    unpickling the solutions imports sympy.
+        hits, misses: Lookup counters.
+        loaded: Whether the file was read.
+    """
+
+    def __init__(self, max_entries, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.loaded = False
+        self.lock = threading.Lock()
+
+
+    def get(self, key):
+        """Return the Shape for key, or None."""
+
+        if self.path and not self.loaded:
+            self.load()
+
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+
+    def put(self, key, shape):
+        """Store shape under key, saving its solution if there's a file."""
+
+        with self.lock:
+            self.entries[key] = shape
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        if self.path:
+            self.save({key: shape.solution})
+
+
+    def read(self):
+        """Return the {key: solution} saved in the file, or {} if it can't be read."""
+
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'rb') as file:
+                return pickle.load(file)
+        except Exception: # pylint: disable=W0703
+            logging.warning('Could not read the shape cache %s, starting empty.', self.path,
+                            exc_info=True)
+            return {}
+
+
+    def load(self):
+        """Add the newest max_entries solutions saved in the file, once."""
+
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+
+        solutions = list(self.read().items())[-self.max_entries:]
+        with self.lock:
+            for key, solution in solutions:
+                self.entries.setdefault(key, Shape(solution))
+
+
+    def save(self, solutions):
+        """
+        Add solutions to the file, keeping the newest max_entries. Other
+        processes may be saving too, so the file is read again first and
+        replaced in one step.
+        """
+
+        saved = self.read()
+        for key, solution in solutions.items():
+            saved.pop(key, None)
+            saved[key] = solution
+        saved = dict(list(saved.items())[-self.max_entries:])
+
+        temporary = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(temporary, 'wb') as file:
+                pickle.dump(saved, file)
+            os.replace(temporary, self.path)
+        except OSError:
+            logging.warning('Could not save the shape cache %s.', self.path, exc_info=True)
+
+
+# Shared by every Topic in this process
+shape_cache = ShapeCache(DEFAULT_SIZE)
+
+
+def configure(config):
+    """
+    Size the process's cache from SHAPE_CACHE_SIZE and keep its solutions
+    in SHAPE_CACHE_PATH, if set, read on first use.
+    """
+    global shape_cache
+
+    shape_cache = ShapeCache(config['SHAPE_CACHE_SIZE'], config['SHAPE_CACHE_PATH'])
+
+
+def lookup(prepped_equation, variables):
+    """
+    Return the TopicShape of prepped_equation, whose variables are named
+    in variables with the answer variable last, solving it if it's new.
+    """
+    from app.solver import solve_symbolically
+
+    key, canonical, order = shape_key(prepped_equation, variables)
+    if key is None:
+        return TopicShape(Shape(None), [])
+
+    shape = shape_cache.get(key)
+    if shape is not None:
+        metrics.inc('shape_cache_lookups', result='hit')
+        return TopicShape(shape, order)
+    metrics.inc('shape_cache_lookups', result='miss')
+
+    names = canonical_names(len(variables))
+    shape = Shape(solve_symbolically(canonical, names[-1], names[:-1]))
+    shape_cache.put(key, shape)
+    return TopicShape(shape, order)
@@ -0,0 +1,240 @@
+"""
+Solves an equation once symbolically, then evaluates the solution for
+each combination of input values with plain Python arithmetic: floats
+confirmed exactly for integer values, Fractions for rational ones.
+"""
+
+# pylint: disable=C0103
+
+import cmath
+import math
+from fractions import Fraction
+from sympy import Poly, Symbol, roots, together, lambdify, ZZ
+from sympy.polys.polyerrors import PolynomialError
+
+
+# Highest degree (in the answer variable) handled in closed form. Above
+# this, the radical formulas get unwieldy and their numeric evaluation
+# is no longer reliable enough to reproduce solveset exactly.
+MAX_DEGREE = 2
+
+# Tolerance used when deciding if a numerically evaluated root is real
+# or an integer. Integer candidates are always confirmed exactly.
+TOLERANCE = 1e-9
+
+
+class DegenerateSolution(Exception):
+    """The closed form doesn't apply to this combination of values."""
+
+
+class ClosedForm():
+    """
+    Store the symbolic solution(s) of an equation for its answer variable,
+    compiled into callables of the input variables.
+        symbols: Sympy symbols for the input variables, then the answer.
+        polys: Numerator and denominator as integer Polys over symbols.
+        leading_coeff: Leading coefficient of the numerator in the answer.
+        roots: Symbolic roots of the numerator in the answer.
+    The roots, numerator, denominator and leading coefficient are also
+    compiled into callables of the input variables (plus the answer for
+    numerator and denominator).
+    """
+
+    def __init__(self, symbols, polys, leading_coeff, symbolic_roots):
+        self.symbols = symbols
+        self.polys = polys
+        self.leading_coeff = leading_coeff
+        self.roots = symbolic_roots
+
+        params, x = symbols[:-1], symbols[-1]
+        modules = [{'sqrt': cmath.sqrt}, 'math']
+        self.branches = [lambdify(params, root, modules=modules) for root in symbolic_roots]
+        self.numerator = lambdify(symbols, polys[0].as_expr(), modules='math')
+        self.denominator = lambdify(symbols, polys[1].as_expr(), modules='math')
+        self.leading = lambdify(params, leading_coeff, modules='math')
+
+
+    @classmethod
+    def compile(cls, prepped_equation, answer_var, input_vars):
+        """
+        Solve prepped_equation for answer_var, leaving input_vars symbolic.
+        Return None when the equation has no usable closed form, see
+        solve_symbolically.
+        """
+
+        solution = solve_symbolically(prepped_equation, answer_var, input_vars)
+        return None if solution is None else cls(*solution)
+
+
+    def solve(self, var_values):
+        """
+        Return the roots for var_values as (integers, others), where
+        integers is a sorted list of exact integer roots and others lists
+        the remaining roots as floats (real) or complex numbers.
+        Raise DegenerateSolution whenever the result might differ from
+        solving that particular combination directly.
+        """
+
+        if self.leading(*var_values) == 0:
+            raise DegenerateSolution
+
+        complex_values = [complex(value) for value in var_values]
+        integers, others = set(), []
+        for branch in self.branches:
+            try:
+                root = complex(branch(*complex_values))
+            except (ZeroDivisionError, OverflowError, ValueError):
+                raise DegenerateSolution
+
+            tolerance = TOLERANCE * max(1, abs(root))
+            nearest = round(root.real)
+            if abs(root - nearest) <= tolerance:
+                # Confirm integer candidates exactly
+                if self.numerator(*var_values, nearest) == 0:
+                    if self.denominator(*var_values, nearest) == 0:
+                        raise DegenerateSolution
+                    integers.add(nearest)
+                    continue
+                if nearest == 0:
+                    raise DegenerateSolution
+
+            if abs(self.denominator(*complex_values, root)) <= tolerance:
+                raise DegenerateSolution
+            others.append(root.real if abs(root.imag) <= tolerance else root)
+
+        return sorted(integers), others
+
+
+def solve_symbolically(prepped_equation, answer_var, input_vars):
+    """
+    Solve prepped_equation for answer_var, leaving input_vars symbolic.
+    Return the arguments of a ClosedForm: (symbols, polys, leading_coeff,
+    roots), which hold no compiled callables and can be pickled. Return
+    None when the equation has no usable closed form, e.g. it isn't
+    polynomial in answer_var or its degree is above MAX_DEGREE.
+    """
+
+    x = Symbol(answer_var)
+    params = [Symbol(var) for var in input_vars]
+    if not prepped_equation.free_symbols <= set(params + [x]):
+        return None
+
+    # Clear denominators so both sides are polynomials with integer
+    # coefficients, which keeps the exact checks in integer arithmetic.
+    numerator, denominator = together(prepped_equation).as_numer_denom()
+    try:
+        numerator = Poly(numerator, x, *params)
+        denominator = Poly(denominator, x, *params)
+    except PolynomialError:
+        return None
+    if numerator.domain != ZZ or denominator.domain != ZZ:
+        return None
+
+    by_x = Poly(numerator.as_expr(), x)
+    degree = by_x.degree()
+    if degree < 1 or degree > MAX_DEGREE:
+        return None
+
+    # roots() reports multiplicities, so an incomplete answer is
+    # easy to spot and we can refuse to use it.
+    symbolic_roots = roots(by_x)
+    if sum(symbolic_roots.values()) != degree:
+        return None
+
+    return params + [x], (numerator, denominator), by_x.LC(), list(symbolic_roots)
+
+
+def rational_sqrt(value):
+    """Return the square root of a non-negative Fraction if it's rational, else None."""
+
+    numerator, denominator = math.isqrt(value.numerator), math.isqrt(value.denominator)
+    if numerator * numerator != value.numerator or denominator * denominator != value.denominator:
+        return None
+    return Fraction(numerator, denominator)
+
+
+class RationalForm():
+    """
+    Store the coefficients of an equation that's linear or quadratic in its
+    answer variable, compiled into callables of the input variables, to
+    find its roots exactly with Fraction arithmetic. Unlike ClosedForm, the
+    input values can be any rationals.
+        degree: Degree of the equation in the answer variable.
+        coefficients: Callables for the numerator's coefficients in the
+            answer variable, highest degree first.
+        denominator: Callable of the input variables and the answer.
+        x_in_denominator: Whether the answer variable is in the denominator.
+    """
+
+    def __init__(self, symbols, coeffs, denominator):
+        params = symbols[:-1]
+        self.degree = len(coeffs) - 1
+        self.coefficients = [lambdify(params, coeff, modules='math') for coeff in coeffs]
+        self.denominator = lambdify(symbols, denominator.as_expr(), modules='math')
+        self.x_in_denominator = denominator.degree(symbols[-1]) > 0
+
+
+    @classmethod
+    def compile(cls, closed_form):
+        """Build a RationalForm from the numerator and denominator of a ClosedForm."""
+
+        numerator, denominator = closed_form.polys
+        coeffs = Poly(numerator.as_expr(), closed_form.symbols[-1]).all_coeffs()
+        return cls(closed_form.symbols, coeffs, denominator)
+
+
+    def solve(self, var_values):
+        """
+        Return the roots for var_values as (rationals, others), like
+        ClosedForm.solve: rationals is a sorted list of exact Fraction
+        roots, others has a float with the exact sign for each irrational
+        root and a complex number for each complex one.
+        Raise DegenerateSolution whenever the result might differ from
+        solving that particular combination directly.
+        """
+
+        coeffs = [Fraction(coefficient(*var_values)) for coefficient in self.coefficients]
+        if coeffs[0] == 0:
+            raise DegenerateSolution
+
+        if self.degree == 1:
+            rationals, others = [-coeffs[1] / coeffs[0]], []
+        else:
+            rationals, others = self.solve_quadratic(*coeffs)
+
+        if others and self.x_in_denominator:
+            raise DegenerateSolution
+        for root in rationals or [Fraction(0)]:
+            if self.denominator(*var_values, root) == 0:
+                raise DegenerateSolution
+
+        return rationals, others
+
+
+    def solve_quadratic(self, a, b, c):
+        """Return the roots of a x**2 + b x + c as (rationals, others)."""
+
+        discriminant = b * b - 4 * a * c
+        if discriminant < 0:
+            real = float(-b / (2 * a))
+            imag = math.sqrt(float(-discriminant)) / abs(float(2 * a))
+            return [], [complex(real, imag), complex(real, -imag)]
+
+        root = rational_sqrt(discriminant)
+        if root is not None:
+            return sorted({(-b + root) / (2 * a), (-b - root) / (2 * a)}), []
+
+        # -b + sign * sqrt(discriminant) is positive when -b is and the
+        # square root doesn't take it below zero, or the other way around.
+        others = []
+        for sign in (1, -1):
+            if sign * b <= 0:
+                positive = sign == 1
+            else:
+                positive = (discriminant > b * b) == (sign == 1)
+            value = (-float(b) + sign * math.sqrt(float(discriminant))) / float(2 * a)
+            # Never zero, so the sign survives floats that round to it
+            magnitude = abs(value) or math.ulp(0.0)
+            others.append(magnitude if positive == (a > 0) else -magnitude)
+
+        return [], others
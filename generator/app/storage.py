@@ -0,0 +1,154 @@
+"""
+Reads a topic's problems back whichever way they're stored: as Problems
+documents, or as compact ProblemBlocks whose LaTeX is rendered again as
+each block is decoded. The results page, exports, queries and updates all
+read through here, so they don't need to know which.
+
+Only a topic's current generation of problems is read. Updating a topic
+writes its new problems as the next generation and then switches the
+topic over, so readers never see a mix of the two.
+"""
+
+from app import compact, features
+from app.models import Problems, ProblemBlocks
+
+
+# The fields of a problem that are read back, in the order they're stored
+FIELDS = ('values', 'answer', 'problem')
+
+
+def current(topic_doc, generation=None):
+    """
+    Return the query arguments for the problems of topic_doc in
+    generation, its current one by default. Problems saved before topics
+    had generations have none and belong to the first.
+    """
+
+    generation = topic_doc.generation if generation is None else generation
+    if not generation:
+        return {'topic': topic_doc.id, 'generation__in': [0, None]}
+
+    return {'topic': topic_doc.id, 'generation': generation}
+
+
+def count_problems(topic_doc):
+    """Return the number of problems topic_doc has."""
+
+    if topic_doc.storage == 'compact':
+        return sum(block['count'] for block in
+                   ProblemBlocks.objects(**current(topic_doc)).only('count').as_pymongo())
+
+    return Problems.objects(**current(topic_doc)).count()
+
+
+def variables_of(topic_doc):
+    """Return the variables of topic_doc as dicts, as a Topic takes them."""
+    return [var.to_mongo().to_dict() for var in topic_doc.variables]
+
+
+def make_renderer(topic_doc):
+    """Return a Topic for topic_doc, only to render its problems."""
+    from app.topic import Topic # pylint: disable=C0415
+
+    return Topic({'equation': topic_doc.equation, 'variables': variables_of(topic_doc)})
+
+
+def decode_blocks(topic_doc, blocks, start=0, stop=None):
+    """
+    Yield the problems in blocks, ProblemBlocks dicts in order, from
+    position start up to stop, with their LaTeX, features and position.
+    Only those problems are rendered.
+    """
+
+    topic = make_renderer(topic_doc)
+    for block in blocks:
+        problems = compact.decode(block['data'], topic.variables)
+        first = max(start - block['position'], 0)
+        last = len(problems) if stop is None else max(stop - block['position'], 0)
+        problems = problems[first:last]
+
+        topic.write_problems(problems)
+        for position, problem in enumerate(problems, block['position'] + first):
+            problem['position'] = position
+            yield problem
+
+
+def iterate_problems(topic_doc, batch_size):
+    """Yield the topic's problems in order, as dicts, batch_size per round trip."""
+
+    if topic_doc.storage == 'compact':
+        blocks = ProblemBlocks.objects(**current(topic_doc)).order_by('position').as_pymongo()
+        return ({field: problem[field] for field in FIELDS}
+                for problem in decode_blocks(topic_doc, blocks))
+
+    return Problems.objects(**current(topic_doc))\
+                   .order_by('position')\
+                   .only(*FIELDS)\
+                   .exclude('id')\
+                   .as_pymongo()\
+                   .batch_size(batch_size)
+
+
+def read_problems(topic_doc, start=0, stop=None):
+    """
+    Return the problems of topic_doc from position start up to stop, or
+    to the end, in order. Compact topics only decode the blocks in range.
+    """
+
+    if topic_doc.storage != 'compact':
+        problems = Problems.objects(position__gte=start, **current(topic_doc))
+        if stop is not None:
+            problems = problems.filter(position__lt=stop)
+        return list(problems.order_by('position').only(*FIELDS).exclude('id').as_pymongo())
+
+    # The blocks that end after start, found by walking back from stop
+    blocks = ProblemBlocks.objects(**current(topic_doc))
+    if stop is not None:
+        blocks = blocks.filter(position__lt=stop)
+    block_ids = []
+    for block in blocks.order_by('-position').only('position', 'count').as_pymongo():
+        if block['position'] + block['count'] <= start:
+            break
+        block_ids.append(block['_id'])
+
+    blocks = ProblemBlocks.objects(id__in=block_ids).order_by('position').as_pymongo()
+    return [{field: problem[field] for field in FIELDS}
+            for problem in decode_blocks(topic_doc, blocks, start, stop)]
+
+
+def query_problems(topic_doc, filters, limit):
+    """
+    Return up to limit problems, in order and with their position, that
+    match filters from features.parse_filters. Compact topics have no
+    index to use, so their blocks are decoded and filtered until enough
+    problems match.
+    """
+
+    if topic_doc.storage != 'compact':
+        return list(Problems.objects(**current(topic_doc), **filters)
+                    .order_by('position')
+                    .only('position', *FIELDS)
+                    .exclude('id')
+                    .limit(limit)
+                    .as_pymongo())
+
+    matched = []
+    blocks = ProblemBlocks.objects(**current(topic_doc)).order_by('position').as_pymongo()
+    for problem in decode_blocks(topic_doc, blocks):
+        if features.matches(problem['features'], filters):
+            matched.append({field: problem[field] for field in ('position',) + FIELDS})
+            if len(matched) >= limit:
+                break
+
+    return matched
+
+
+def delete_problems(topic_doc, generation=None):
+    """
+    Delete the problems of topic_doc in generation, or in every generation
+    by default, however they're stored.
+    """
+
+    query = {'topic': topic_doc.id} if generation is None else current(topic_doc, generation)
+    Problems.objects(**query).delete()
+    ProblemBlocks.objects(**query).delete()
@@ -2,18 +2,31 @@
 Accepts equations, then generates sample problems.
 """
 
-# pylint: disable=C0103, W1202, R0201
+# pylint: disable=C0103, R0201
 
 import logging
 import itertools
-from sympy import FiniteSet, ConditionSet
-from sympy.abc import x
+import random
+from fractions import Fraction
+import numpy as np
+from sympy import FiniteSet, S, Symbol
 from sympy.solvers import solveset
-from sympy.parsing.sympy_parser import parse_expr,\
-                                       standard_transformations,\
-                                       implicit_multiplication_application
-from sympy.printing import latex
+from app import features, metrics, number_types, parallel, rendering, shapes
 from app.utilities import timer
+from app.solver import DegenerateSolution
+
+
+# Number of combinations solved per step of the generation pipeline.
+CHUNK_SIZE = 10000
+
+# Hard cap on the number of problems kept for a single topic.
+MAX_PROBLEMS = 100000
+
+# Sampling gives up and enumerates every combination once at least
+# MIN_SAMPLE_DRAWS combinations were drawn and fewer than this fraction of
+# them were valid, or once half of all combinations were drawn.
+MIN_ACCEPTANCE_RATE = 0.02
+MIN_SAMPLE_DRAWS = 1000
 
 
 class Topic():
@@ -21,19 +34,48 @@ class Topic():
     Store data associated with each equation.
         equation: User inputted equation  # May want to change this to sympy formatted equation
         type: Specifies whether it is an equation, inequality or expression. # Not built yet
-        variables: Defines parameters for each variable.
+        variables: Defines parameters for each variable. Their num_type
+            picks integers, fractions or decimals, see number_types.
         problems: Lists variable values for all valid problems.
+        sample_size: If set in equation_dict, only this many valid problems
+            are drawn at random, reproducibly for a given seed.
+        engine: 'closed_form' solves the equation once symbolically,
+            'numpy' also evaluates that solution over the whole grid at
+            once, 'solveset' solves it again for every combination.
+        chunk_size: Number of combinations solved per pipeline step.
+        max_problems: Generation stops once this many problems are found.
+        workers: Number of processes solving chunks; 1 solves in-process.
+        prune: Whether to rule out combinations that provably can't be
+            valid before solving them. pruned counts them.
+        integer: Whether every variable is an integer. Otherwise values
+            are Fractions, solved exactly by a RationalForm, and neither
+            pruning nor the numpy engine's grid apply.
     """
 
     @timer
-    def __init__(self, equation_dict):
+    def __init__(self, equation_dict, engine='closed_form',
+                 chunk_size=CHUNK_SIZE, max_problems=MAX_PROBLEMS, workers=1, prune=True):
         """Initialize the equation object."""
         self.equation = equation_dict['equation']
         self.variables = equation_dict['variables']
         self.dict = equation_dict
         self.x = list(self.variables)[-1]['variable'] # The variable to solve for
+        self.engine = engine
+        self.chunk_size = chunk_size
+        self.max_problems = max_problems
+        self.workers = workers
+        self.prune = prune
+        self.pruned = 0
+        self.integer = number_types.is_integer(self.variables)
+        self.closed_form = None # Set by compile_solver
+        self.grid_solver = None
+        self.pruner = None
+        self.templates = None # Set by write_problems
+        if self.dict.get('sample_size') and self.dict.get('seed') is None:
+            self.dict['seed'] = random.randrange(2**31) # Recorded to reproduce the sample
 
 
+    @timer
     def prep_equation(self):
         """
         Transform the inputted equation into a sympy readable equation.
@@ -47,23 +89,22 @@ class Topic():
         prepped_equation = self.equation.replace("=", "-(") + ")"
 
         # This transforms the equation string into a sympy-readable equation.
-        transformations = standard_transformations + (implicit_multiplication_application,)
-        prepped_equation = parse_expr(prepped_equation, transformations=transformations)
+        prepped_equation = rendering.parse(prepped_equation)
 
         return prepped_equation
 
 
     @timer
-    def generate_var_ranges(self):
+    def generate_var_ranges(self, variables=None):
         """
         Generate dict of all possible values for each input variable. Do
         not generate all possible values of self.x, as that's the variable
-        we'll solve for.
+        we'll solve for. variables defaults to self.variables.
         """
 
         var_ranges = {}
-        for var in self.variables:
-            min_to_max = list(range(int(var['min']), int(var['max']) + 1))
+        for var in variables or self.variables:
+            min_to_max = number_types.value_range(var)
             if (var['zero_ok'] == False and 0 in min_to_max):
                 min_to_max.remove(0)
 
@@ -72,11 +113,11 @@ class Topic():
         return var_ranges
 
 
-    @timer
     def generate_input_array(self, var_ranges):
         """
-        Using the var_ranges, generate array of all possible variable-value
-        combinations, excluding the variable to be solved for.
+        Using the var_ranges, generate all possible variable-value
+        combinations, excluding the variable to be solved for. The
+        combinations are produced lazily, as tuples.
         """
 
         # Pull all possible values for each input variable from the
@@ -85,10 +126,263 @@ class Topic():
         input_values = [var_ranges[k] for i, k in enumerate(var_ranges)
                         if i < len(var_ranges)-1]
 
-        # Generate all possible variable combinations as a list of tuples
-        input_array = list(itertools.product(*input_values))
+        # Generate all possible variable combinations as tuples
+        return itertools.product(*input_values)
+
+
+    def count_values(self):
+        """
+        Count the values generate_var_ranges lists for each variable, from
+        their bounds alone, so huge ranges are never listed.
+        """
+
+        counts = {}
+        for var in self.variables:
+            counts[var['variable']] = number_types.count_values(var)
+            if var['zero_ok'] == False and int(var['min']) <= 0 <= int(var['max']):
+                counts[var['variable']] -= 1
+
+        return counts
+
+
+    def count_input_combinations(self):
+        """Count the combinations count_combinations would, without listing the ranges."""
+
+        count = 1
+        for i, values in enumerate(self.count_values().values()):
+            if i < len(self.variables)-1:
+                count *= values
+
+        return count
+
+
+    def count_combinations(self, var_ranges):
+        """Count the combinations generate_input_array will produce."""
+
+        count = 1
+        for i, k in enumerate(var_ranges):
+            if i < len(var_ranges)-1:
+                count *= len(var_ranges[k])
+
+        return count
+
+
+    def generate_input_grid(self, var_ranges, rows):
+        """
+        Same combinations as generate_input_array, but only the given rows
+        (numbered like itertools.product) and as one NumPy array per input
+        variable.
+        """
+
+        dtype = np.int64 if self.integer else object
+        input_values = [np.array(var_ranges[k], dtype=dtype) for i, k in enumerate(var_ranges)
+                        if i < len(var_ranges)-1]
+        if not input_values:
+            return []
+
+        index = np.unravel_index(rows, [len(values) for values in input_values])
+        return [values[i] for values, i in zip(input_values, index)]
+
+
+    def generate_input_rows(self, var_ranges, rows):
+        """
+        Return the given rows of the input combinations, as a grid for the
+        numpy engine or as a list of tuples otherwise.
+        """
+
+        input_grid = self.generate_input_grid(var_ranges, rows)
+        if self.pruner is not None and input_grid:
+            eliminated = self.pruner.eliminate(input_grid,
+                                               np.array(var_ranges[self.x], dtype=np.int64),
+                                               self.dict['positive_only'] == True)
+            self.pruned += int(eliminated.sum())
+            metrics.inc('combinations_pruned', int(eliminated.sum()))
+            input_grid = [column[~eliminated] for column in input_grid]
+
+        if self.engine == 'numpy':
+            return input_grid
+        if not input_grid:
+            return [()]
+
+        return list(zip(*(column.tolist() for column in input_grid)))
+
+
+    def generate_input_slice(self, var_ranges, start, stop):
+        """Return rows start to stop of the input combinations, like generate_input_rows."""
+        return self.generate_input_rows(var_ranges, np.arange(start, stop))
+
+
+    def generate_chunk_bounds(self, var_ranges):
+        """Yield (start, stop) rows for each chunk of input combinations."""
+
+        total = self.count_combinations(var_ranges)
+        for start in range(0, total, self.chunk_size):
+            yield start, min(start + self.chunk_size, total)
+
+
+    def generate_input_chunks(self, var_ranges):
+        """
+        Yield the input combinations in chunks of self.chunk_size, as lists
+        of tuples or, for the numpy engine, as grids. Pruned combinations
+        are left out, so chunks may come out smaller.
+        """
+
+        if self.engine == 'numpy' or self.pruner is not None:
+            for start, stop in self.generate_chunk_bounds(var_ranges):
+                yield self.generate_input_slice(var_ranges, start, stop)
+            return
+
+        input_array = self.generate_input_array(var_ranges)
+        while True:
+            chunk = list(itertools.islice(input_array, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+    def solve_combo(self, prepped_equation, var_values, answer_values):
+        """
+        Solve prepped_equation for self.x with solveset, given the values
+        of the input variables. Return the list of answers if the
+        combination is valid, otherwise None.
+        """
+
+        # Substitute the values for each input variable into the
+        # final_equation so sympy can solve for the remaining variable.
+        final_equation = prepped_equation.subs([(var['variable'], value) for var, value
+                                                in zip(self.variables[:-1], var_values)])
+
+        # Solve for self.x.
+        metrics.inc('solveset_calls')
+        return self.check_solution(solveset(final_equation, Symbol(self.x)), answer_values)
+
+
+    def check_solution(self, solution, answer_values):
+        """
+        Validate a solveset result against answer_values, the set of values
+        self.x may take. The roots are turned into plain numbers once, then
+        checked with the same rules as check_roots:
+            Empty set: valid, with no answers.
+            Finite set: valid if every real root is in answer_values. Complex
+                roots, or roots sympy can't tell are real, make it invalid.
+                With positive_only, roots that aren't positive are dropped.
+            Anything else (infinite sets, intervals, conditional or image
+                sets solveset couldn't resolve): invalid.
+        Return the list of answers if the combination is valid, otherwise None.
+        """
+
+        if solution is S.EmptySet:
+            return []
+        if not isinstance(solution, FiniteSet):
+            return None
+
+        positive_only = self.dict['positive_only'] == True
+        answers = []
+        for root in solution:
+            if not root.is_number or root.is_real is not True:
+                return None
+            if positive_only and not root.is_positive:
+                continue
+            if not root.is_Rational:
+                return None
+
+            answer = int(root) if root.is_Integer else Fraction(int(root.p), int(root.q))
+            if answer not in answer_values:
+                return None
+            answers.append(answer)
+
+        return answers
+
+
+    def check_roots(self, roots, answer_values):
+        """
+        Apply the same rules as solve_combo to roots already computed by a
+        ClosedForm or RationalForm. Return the list of answers if the
+        combination is valid, otherwise None.
+        """
+
+        integers, others = roots
+
+        # solveset can't decide positivity for complex roots, so those
+        # combinations never validate.
+        if any(isinstance(root, complex) for root in others):
+            return None
+
+        if self.dict['positive_only'] == True:
+            integers = [root for root in integers if root > 0]
+            others = [root for root in others if root > 0]
+
+        if others or not set(integers) <= answer_values:
+            return None
+
+        return integers
+
+
+    def compile_solver(self, prepped_equation):
+        """
+        Solve the equation once for self.x if the engine allows it, leaving
+        the input variables symbolic. self.closed_form stays None if there's
+        no closed form, in which case every combination goes to solveset.
+        The pruner is built from the same solution, whatever the engine.
+        Topics with non-integer variables get a RationalForm instead.
+        All of these are shared with other topics of the same equation
+        shape, see shapes.py.
+        """
+
+        if self.engine not in ('closed_form', 'numpy') and not self.prune:
+            return
 
-        return input_array
+        shape = shapes.lookup(prepped_equation, [var['variable'] for var in self.variables])
+        closed_form = shape.closed_form()
+        if closed_form is None:
+            return
+
+        if not self.integer:
+            if self.engine in ('closed_form', 'numpy'):
+                self.closed_form = shape.rational_form()
+            return
+
+        if self.prune:
+            self.pruner = shape.pruner()
+        if self.engine in ('closed_form', 'numpy'):
+            self.closed_form = closed_form
+        if self.engine == 'numpy':
+            self.grid_solver = shape.grid_solver()
+
+
+    def answer_combo(self, closed_form, prepped_equation, var_values, answer_values):
+        """
+        Return the list of answers for var_values, or None if the combination
+        isn't valid. Combinations the closed form can't handle are solved
+        individually.
+        """
+
+        if closed_form is None:
+            return self.solve_combo(prepped_equation, var_values, answer_values)
+
+        try:
+            return self.check_roots(closed_form.solve(var_values), answer_values)
+        except DegenerateSolution:
+            return self.solve_combo(prepped_equation, var_values, answer_values)
+
+
+    def package_combo(self, var_values, answers):
+        """Package a valid combination as a dict."""
+
+        valid_combo = {}
+        valid_combo['values'] = {}
+
+        # Add variable values to dict, as ints or strings like '3/4'
+        for i, var in enumerate(self.variables):
+            if i < len(self.variables)-1:
+                valid_combo['values'][var['variable']] = number_types.format_value(var,
+                                                                                   var_values[i])
+
+        # Add answer value(s) to dict
+        valid_combo['values'][self.x] = [number_types.format_value(self.variables[-1], answer)
+                                         for answer in answers]
+
+        return valid_combo
 
 
     @timer
@@ -97,94 +391,354 @@ class Topic():
 
         valid_combos = []
 
-        # Generate the set of valid answer values as a FiniteSet. The
-        # FiniteSet is necessary because sympy returns a FiniteSet when
-        # it solves equations.
-        solution_set = FiniteSet(*var_ranges[str(self.x)])
-
-        # For every variable combination, substitute the values for each
-        # input variable into the final_equation so sympy can solve for the
-        # remaining variable.
+        # The values self.x may take, as a plain set for check_roots and
+        # check_solution
+        answer_values = set(var_ranges[str(self.x)])
 
+        evaluated = 0
         for var_values in input_array:
-            final_equation = prepped_equation
-            for i, var in enumerate(self.variables):
-                if i < len(self.variables)-1:
-                    final_equation = final_equation.subs(var['variable'], var_values[i])
+            answers = self.answer_combo(self.closed_form, prepped_equation, var_values,
+                                        answer_values)
+            evaluated += 1
 
-            # Solve for self.x.
-            answer = solveset(final_equation, self.x)
+            # Add valid combinations to valid_combos list, with each valid combo as a dict
+            if answers is not None:
+                valid_combos.append(self.package_combo(var_values, answers))
 
-            #### Currently, this is just rigged to capture when we have a single integer solution
-            if self.dict['positive_only'] == True:
-                answer = answer.intersection(ConditionSet(x, x > 0))
+        metrics.inc('combinations_evaluated', evaluated)
+        return valid_combos
 
-            # Add valid combinations to valid_combos list, with each valid combo as a dict
-            if answer.issubset(solution_set) and answer != set():
-                valid_combo = {}
-                valid_combo['values'] = {}
 
-                # Add variable values to dict
-                for i, var in enumerate(self.variables):
-                    if i < len(self.variables)-1:
-                        valid_combo['values'][var['variable']] = int(var_values[i])    ### Forces int, which needs to be updated
+    @timer
+    def generate_valid_combos_vectorized(self, prepped_equation, var_ranges, input_grid):
+        """
+        Generate the same list as generate_valid_combos, but classify the
+        whole input_grid at once with NumPy. Rows the grid can't settle
+        exactly go through answer_combo one at a time.
+        """
 
-                # Add answer value(s) to dict
-                valid_combo['values'][self.x] = [int(i) for i in answer]
+        if self.grid_solver is None:
+            input_array = list(zip(*input_grid)) if input_grid else [()]
+            return self.generate_valid_combos(prepped_equation, var_ranges, input_array)
 
-                valid_combos.append(valid_combo)
+        valid_combos = []
+        answer_values = set(var_ranges[str(self.x)])
+
+        valid, uncertain, kept, nearest = self.grid_solver.classify(
+            input_grid, np.array(var_ranges[str(self.x)], dtype=np.int64),
+            self.dict['positive_only'] == True)
+        metrics.inc('combinations_evaluated', len(valid))
+
+        # Walk the rows in the same order as itertools.product
+        columns = [column.tolist() for column in input_grid]
+        for row in np.flatnonzero(valid | uncertain).tolist():
+            var_values = tuple(column[row] for column in columns)
+            if uncertain[row]:
+                answers = self.answer_combo(self.closed_form, prepped_equation, var_values,
+                                            answer_values)
+            else:
+                answers = sorted({int(nearest[b][row]) for b in range(len(kept)) if kept[b][row]})
+
+            if answers is not None:
+                valid_combos.append(self.package_combo(var_values, answers))
 
         return valid_combos
 
 
+    @timer
     def write_problems(self, valid_combos):
         """Takes variable values and returns problem / answer pairs as LaTeX."""
 
-        # To be used when converting the equation to sympy
-        transformations = standard_transformations + (implicit_multiplication_application,)
+        input_vars = [var['variable'] for var in self.variables[:-1]]
+        if self.templates is None:
+            self.templates = rendering.ProblemTemplates(self.equation, input_vars, self.integer)
 
-        # To preserve the order of the expression, may need to sub each arg separately and then reconstruct the whole equation (sympy can identify each term as an arg)
         for combo in valid_combos:
+            # Store the answer(s)
+            answers = combo['values'][self.x]
+            if len(answers) == 1:
+                combo['answer'] = f"{self.x} = {answers[0]}"
+            else:
+                combo['answer'] = f"{self.x} = [{', '.join(str(answer) for answer in answers)}]"
 
-            # Sympy doesn't like equations, so this allows it to evaluate
-            # the left and right side independently
-            subbed_left_side = self.equation[:self.equation.find('=')]
-            subbed_right_side = self.equation[self.equation.find('=')+1:]
+            combo['features'] = features.problem_features(combo['values'])
 
-            for i, var in enumerate(self.variables):
-                variable = var['variable']
-                # Replace non-answer variables with values
-                if i < len(self.variables)-1:
-                    subbed_left_side = subbed_left_side.replace(variable, str(combo['values'][variable]))
-                    subbed_right_side = subbed_right_side.replace(variable, str(combo['values'][variable]))
+            values = [combo['values'][var] for var in input_vars]
+            if not self.integer:
+                values = [number_types.substitution(value) for value in values]
+            combo['problem'] = self.templates.render(values)
 
-                # Store the answer(s)
-                else:
-                    if len(combo['values'][variable]) == 1:
-                        combo['answer'] = f"{variable} = {combo['values'][variable][0]}"
-                    else:
-                        combo['answer'] = f"{variable} = {combo['values'][variable]}"
 
-            # Latexify each side of the equation, then concatenate
-            latex_left_side = latex(parse_expr(subbed_left_side,
-                                               transformations=transformations,
-                                               evaluate=False))
-            latex_right_side = latex(parse_expr(subbed_right_side,
-                                                transformations=transformations,
-                                                evaluate=False))
-            latex_problem = str(latex_left_side) + ' = ' + str(latex_right_side)
+    def find_valid_combos(self, prepped_equation, var_ranges, chunk):
+        """Solve combinations with the topic's engine and return the valid ones, unwritten."""
 
-            combo['problem'] = str(latex_problem)
+        if self.engine == 'numpy':
+            return self.generate_valid_combos_vectorized(prepped_equation, var_ranges, chunk)
 
+        return self.generate_valid_combos(prepped_equation, var_ranges, chunk)
+
+
+    def solve_chunk(self, prepped_equation, var_ranges, chunk):
+        """Solve one chunk of combinations and write its valid problems."""
+
+        valid_combos = self.find_valid_combos(prepped_equation, var_ranges, chunk)
+        self.write_problems(valid_combos)
+        metrics.inc('valid_problems', len(valid_combos))
+        return valid_combos
 
-    def generate_problems(self):
-        """Update self.dict with list of viable inputs for each variable."""
+
+    def solve_chunks(self):
+        """Yield the solved chunks in order, working in this process."""
 
         prepped_equation = self.prep_equation()
         var_ranges = self.generate_var_ranges()
-        input_array = self.generate_input_array(var_ranges)
-        valid_combos = self.generate_valid_combos(prepped_equation, var_ranges, input_array)
-        self.write_problems(valid_combos)
-        self.dict['problems'] = valid_combos
-        logging.info(f"Generated {len(self.dict['problems'])} valid problems.")
-        logging.info(self.dict['problems'])
+        self.compile_solver(prepped_equation)
+
+        for chunk in self.generate_input_chunks(var_ranges):
+            yield self.solve_chunk(prepped_equation, var_ranges, chunk)
+
+
+    def solve_all_chunks(self):
+        """Yield the solved chunks in order, in a process pool if self.workers > 1."""
+
+        if self.workers > 1:
+            return parallel.solve_chunks(self)
+
+        return self.solve_chunks()
+
+
+    def generate_problem_chunks(self):
+        """
+        Yield finished problems one chunk at a time, so memory stays flat no
+        matter how large the ranges are. Each chunk of combinations goes
+        through the solver, is filtered down to valid problems and written
+        as LaTeX. Stops once self.max_problems problems have been yielded.
+        """
+
+        solved_chunks = self.solve_all_chunks()
+
+        remaining = self.max_problems
+        for valid_combos in solved_chunks:
+            valid_combos = valid_combos[:remaining]
+            yield valid_combos
+
+            remaining -= len(valid_combos)
+            if remaining <= 0:
+                logging.warning('Stopped at the limit of %d problems.', self.max_problems)
+                solved_chunks.close()
+                return
+
+
+    def generate_problems(self, progress=None, sink=None):
+        """
+        Update self.dict with list of viable inputs for each variable.
+        progress, if given, is called after each chunk with the number of
+        chunks done, the total number of chunks and the problems so far.
+        sink, if given, is called with each chunk's problems as soon as
+        they're solved, e.g. to save them while the rest are solved.
+        With a sample_size, only a random sample of them is kept, sink
+        gets them all at the end and progress is called as in
+        generate_sample.
+        """
+
+        if self.dict.get('sample_size'):
+            self.generate_sample(progress)
+            if sink is not None:
+                sink(self.dict['problems'])
+            return
+
+        var_ranges = self.generate_var_ranges()
+        combinations = self.count_combinations(var_ranges)
+        chunks_total = -(-combinations // self.chunk_size)
+
+        self.dict['problems'] = []
+        self.pruned = 0
+        for chunks_done, problems in enumerate(self.generate_problem_chunks(), 1):
+            self.dict['problems'].extend(problems)
+            if sink is not None:
+                sink(problems)
+            if progress is not None:
+                progress(chunks_done, chunks_total, len(self.dict['problems']))
+        logging.info('Generated %d valid problems for %s, pruning %d of %d combinations '
+                     'before solving.', len(self.dict['problems']), self.equation,
+                     self.pruned, combinations)
+
+
+    def sort_problems(self, problems, var_ranges):
+        """Sort problems in place into the order of the input combinations."""
+
+        input_vars = list(var_ranges)[:-1]
+        positions = {var: {value: i for i, value in enumerate(var_ranges[var])}
+                     for var in input_vars}
+        parse = number_types.parse if not self.integer else lambda value: value
+        problems.sort(key=lambda problem: [positions[var][parse(problem['values'][var])]
+                                           for var in input_vars])
+
+
+    def generate_sample(self, progress=None):
+        """
+        Set self.dict['problems'] to sample_size valid problems, chosen
+        uniformly at random with self.dict['seed'] and kept in the order
+        of the input combinations. Random combinations are drawn and solved
+        in batches until enough are valid. If valid combinations turn out
+        to be rare, every combination is solved and the sample is drawn
+        from the results instead.
+        progress, if given, is called after each batch with the problems
+        found, the sample size, the problems found and unit='problems', or
+        after each chunk while solving every combination, like in
+        generate_problems. It may raise to stop sampling.
+        """
+
+        var_ranges = self.generate_var_ranges()
+        total = self.count_combinations(var_ranges)
+        sample_size = min(int(self.dict['sample_size']), self.max_problems)
+        rng = random.Random(self.dict['seed'])
+
+        prepped_equation = self.prep_equation()
+        self.compile_solver(prepped_equation)
+
+        problems, drawn = [], set()
+        while len(problems) < sample_size:
+            if len(drawn) * 2 >= total or (len(drawn) >= MIN_SAMPLE_DRAWS and
+                                           len(problems) < MIN_ACCEPTANCE_RATE * len(drawn)):
+                logging.info('Found %d valid problems in %d draws, solving all %d '
+                             'combinations instead.', len(problems), len(drawn), total)
+                self.dict['problems'] = self.choose_sample(rng, sample_size, progress)
+                return
+
+            # Size each batch by the acceptance rate seen so far
+            needed = sample_size - len(problems)
+            rate = (len(problems) + 1) / (len(drawn) + 1)
+            batch_size = min(self.chunk_size, int(needed / rate) + 1, total - len(drawn))
+            rows = set()
+            while len(rows) < batch_size:
+                row = rng.randrange(total)
+                if row not in drawn:
+                    drawn.add(row)
+                    rows.add(row)
+
+            valid_combos = self.solve_chunk(prepped_equation, var_ranges,
+                                            self.generate_input_rows(var_ranges, sorted(rows)))
+            if len(valid_combos) > needed:
+                valid_combos = rng.sample(valid_combos, needed)
+            problems.extend(valid_combos)
+            if progress is not None:
+                progress(len(problems), sample_size, len(problems), unit='problems')
+
+        self.sort_problems(problems, var_ranges)
+        self.dict['problems'] = problems
+        logging.info('Sampled %d valid problems in %d draws, %d of them pruned before solving.',
+                     len(problems), len(drawn), self.pruned)
+
+
+    def choose_sample(self, rng, sample_size, progress=None):
+        """
+        Solve every combination and return sample_size of the valid problems,
+        chosen with rng by reservoir sampling so memory stays bounded by the
+        sample size. progress is called after each chunk like in
+        generate_problems.
+        """
+
+        chunks_total = -(-self.count_input_combinations() // self.chunk_size)
+        sample, seen = [], 0
+        for chunks_done, valid_combos in enumerate(self.solve_all_chunks(), 1):
+            if progress is not None:
+                progress(chunks_done, chunks_total, min(seen + len(valid_combos), sample_size))
+            for combo in valid_combos:
+                if len(sample) < sample_size:
+                    sample.append(combo)
+                else:
+                    index = rng.randrange(seen + 1)
+                    if index < sample_size:
+                        sample[index] = combo
+                seen += 1
+
+        self.sort_problems(sample, self.generate_var_ranges())
+        return sample
+
+
+    def generate_added_ranges(self, old_ranges, new_ranges):
+        """
+        Split the input combinations in new_ranges but not in old_ranges into
+        disjoint boxes, each a var_ranges dict. Box i keeps the earlier input
+        variables to the values both ranges share, takes variable i's added
+        values and leaves the later variables free.
+        """
+
+        input_vars = list(new_ranges)[:-1]
+        boxes = []
+        for i, var in enumerate(input_vars):
+            box = {}
+            for j, other in enumerate(input_vars):
+                old_values = set(old_ranges[other])
+                if j < i:
+                    box[other] = [value for value in new_ranges[other] if value in old_values]
+                elif j == i:
+                    box[other] = [value for value in new_ranges[other] if value not in old_values]
+                else:
+                    box[other] = new_ranges[other]
+            box[self.x] = new_ranges[self.x]
+
+            if all(box[other] for other in input_vars):
+                boxes.append(box)
+
+        return boxes
+
+
+    def update_problems(self, old_variables, old_problems, progress=None):
+        """
+        Set self.dict['problems'] for self.variables by patching old_problems,
+        which were generated for the same equation with old_variables.
+        Problems outside the new ranges are dropped and only the combinations
+        the old ranges didn't cover are solved, so the result matches a full
+        generate_problems. Return False, leaving self.dict alone, when that
+        can't be guaranteed: if the answer range grew, combinations rejected
+        before might now be valid, if old_problems hit self.max_problems,
+        some were never generated, a sample has to be drawn again, and
+        if a variable's num_type or precision changed, so did its values.
+        progress is called like in generate_problems.
+        """
+
+        old_ranges = self.generate_var_ranges(old_variables)
+        new_ranges = self.generate_var_ranges()
+        answer_values = set(new_ranges[self.x])
+        if not answer_values <= set(old_ranges[self.x]) or len(old_problems) >= self.max_problems \
+                or self.dict.get('sample_size'):
+            return False
+        if [(number_types.num_type(var), number_types.precision(var)) for var in old_variables] \
+                != [(number_types.num_type(var), number_types.precision(var))
+                    for var in self.variables]:
+            return False
+
+        input_vars = list(new_ranges)[:-1]
+        input_values = {var: set(new_ranges[var]) for var in input_vars}
+        parse = number_types.parse if not self.integer else lambda value: value
+        problems = [problem for problem in old_problems
+                    if all(parse(problem['values'][var]) in input_values[var] for var in input_vars)
+                    and {parse(answer) for answer in problem['values'][self.x]} <= answer_values]
+        dropped = len(old_problems) - len(problems)
+
+        boxes = self.generate_added_ranges(old_ranges, new_ranges)
+        chunks_total = sum(-(-self.count_combinations(box) // self.chunk_size) for box in boxes)
+        chunks_done = 0
+        if boxes:
+            prepped_equation = self.prep_equation()
+            self.compile_solver(prepped_equation)
+        for box in boxes:
+            for chunk in self.generate_input_chunks(box):
+                problems.extend(self.solve_chunk(prepped_equation, box, chunk))
+                chunks_done += 1
+                if progress is not None:
+                    progress(chunks_done, chunks_total, len(problems))
+
+        # Restore the order a full generation would produce
+        self.sort_problems(problems, new_ranges)
+        if len(problems) > self.max_problems:
+            logging.warning('Stopped at the limit of %d problems.', self.max_problems)
+
+        self.dict['problems'] = problems[:self.max_problems]
+        if progress is not None:
+            progress(chunks_total, chunks_total, len(self.dict['problems']))
+        logging.info('Kept %d problems, dropped %d and added %d.', len(old_problems) - dropped,
+                     dropped, len(problems) - len(old_problems) + dropped)
+        return True
@@ -1,21 +1,62 @@
 """Utility functions for ChalkDoc."""
 
-# pylint: disable=W0612, W1202
+# pylint: disable=W0603
 
+import atexit
+import functools
 import logging
+import os
+import queue
 import time
+from logging.handlers import QueueHandler, QueueListener
+from app import metrics
 
-def start_logging():
-    """Start logging level at INFO."""
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger()
+
+# Writes the queued log records in the background, when LOG_QUEUE is on
+log_listener = None
+
+
+def configure_logging(config):
+    """
+    Set up the root logger from LOG_LEVEL and LOG_FORMAT in config. With
+    LOG_QUEUE, the logging thread only puts records on a queue and a
+    background thread writes them, so requests never wait on log I/O.
+    """
+    global log_listener
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(config['LOG_FORMAT']))
+    root = logging.getLogger()
+    root.setLevel(config['LOG_LEVEL'])
+    root.handlers = []
+
+    if not config['LOG_QUEUE']:
+        root.addHandler(handler)
+        return
+
+    log_queue = queue.SimpleQueue()
+    root.addHandler(QueueHandler(log_queue))
+    log_listener = QueueListener(log_queue, handler)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+
+    # Forked worker processes don't get the listener thread, so they
+    # write their records directly.
+    os.register_at_fork(after_in_child=lambda: setattr(root, 'handlers', [handler]))
 
 
 def timer(func):
-    """Decorator to calculate and return runtime for wrapped functions."""
+    """
+    Decorator to time wrapped functions. Each runtime is recorded in the
+    stage_seconds histogram of app.metrics, labelled with the function name.
+    """
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        function_result = func(*args, **kwargs)
-        logging.info(f'{func.__name__} runtime: {time.time() - start_time}.')
-        return function_result
+        start_time = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            runtime = time.perf_counter() - start_time
+            metrics.observe('stage_seconds', runtime, stage=func.__name__)
+            logging.debug('%s runtime: %s.', func.__name__, runtime)
     return wrapper
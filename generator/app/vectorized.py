@@ -0,0 +1,114 @@
+"""
+Evaluates a ClosedForm over the whole grid of input values at once with
+NumPy, classifying every combination with boolean masks.
+"""
+
+# pylint: disable=C0103
+
+import numpy as np
+from sympy import Poly, lambdify
+from app.solver import TOLERANCE
+
+
+# Integer evaluations of the numerator and denominator stay exact as long
+# as no term can exceed this bound. Rows that might are left to the
+# scalar ClosedForm, which works with unbounded Python ints.
+INT_BOUND = 2**62
+
+
+class GridSolver():
+    """
+    Store a ClosedForm compiled into NumPy callables.
+        closed_form: The ClosedForm being vectorized.
+        bounds: (sum of absolute coefficients, total degree) for the
+            numerator, denominator and leading coefficient, used to
+            guard the int64 evaluations against overflow.
+    """
+
+    def __init__(self, closed_form):
+        self.closed_form = closed_form
+
+        symbols = closed_form.symbols
+        params = symbols[:-1]
+        numerator, denominator = closed_form.polys
+        leading_coeff = Poly(closed_form.leading_coeff, *symbols)
+
+        self.branches = [lambdify(params, root, modules='numpy') for root in closed_form.roots]
+        self.numerator = lambdify(symbols, numerator.as_expr(), modules='numpy')
+        self.denominator = lambdify(symbols, denominator.as_expr(), modules='numpy')
+        self.leading = lambdify(params, leading_coeff.as_expr(), modules='numpy')
+        self.bounds = [(sum(abs(int(coeff)) for coeff in poly.coeffs()), poly.total_degree())
+                       for poly in (numerator, denominator, leading_coeff)]
+
+
+    def overflows(self, magnitude):
+        """Flag rows where an int64 evaluation might overflow."""
+        return np.logical_or.reduce([coeff_sum * np.maximum(magnitude, 1.0)**degree > INT_BOUND
+                                     for coeff_sum, degree in self.bounds])
+
+
+    def classify(self, columns, answer_values, positive_only):
+        """
+        Classify every row of columns, one int64 array per input variable.
+        Return (valid, uncertain, kept, nearest):
+            valid: Rows that produce a valid problem.
+            uncertain: Rows the grid can't settle exactly, which must be
+                solved one at a time.
+            kept: Per branch, rows where the branch is a kept answer.
+            nearest: Per branch, the integer value of each root.
+        """
+
+        size = len(columns[0]) if columns else 1
+        int_columns = [np.asarray(column, dtype=np.int64) for column in columns]
+        complex_columns = [column.astype(np.complex128) for column in int_columns]
+        magnitude = np.zeros(size)
+        for column in int_columns:
+            magnitude = np.maximum(magnitude, np.abs(column).astype(float))
+
+        invalid = np.zeros(size, dtype=bool)
+        uncertain = np.zeros(size, dtype=bool)
+        kept, nearest_ints = [], []
+
+        with np.errstate(all='ignore'):
+            root_values = [np.broadcast_to(branch(*complex_columns), (size,)).astype(np.complex128)
+                           for branch in self.branches]
+            finite = np.logical_and.reduce([np.isfinite(root) for root in root_values])
+            for root in root_values:
+                magnitude = np.maximum(magnitude, np.where(finite, np.abs(root), 0.0))
+            uncertain |= ~finite | self.overflows(magnitude)
+
+            # Evaluate the exact checks only where int64 is safe
+            safe = ~uncertain
+            int_columns = [np.where(safe, column, 0) for column in int_columns]
+            uncertain |= np.broadcast_to(self.leading(*int_columns), (size,)) == 0
+
+            for root in root_values:
+                root = np.where(safe, root, 0)
+                tolerance = TOLERANCE * np.maximum(1.0, np.abs(root))
+                nearest = np.rint(root.real)
+                near = np.abs(root - nearest) <= tolerance
+                nearest_int = nearest.astype(np.int64)
+
+                # Confirm integer candidates exactly
+                exact = near & (np.broadcast_to(self.numerator(*int_columns, nearest_int), (size,)) == 0)
+                uncertain |= exact & (np.broadcast_to(self.denominator(*int_columns, nearest_int), (size,)) == 0)
+                uncertain |= near & ~exact & (nearest == 0)
+                den = np.broadcast_to(self.denominator(*complex_columns, root), (size,))
+                uncertain |= ~exact & (np.abs(den) <= tolerance)
+
+                # Non-integer roots invalidate the row unless positive_only
+                # discards them as real negatives.
+                real = np.abs(root.imag) <= tolerance
+                if positive_only:
+                    invalid |= ~exact & (~real | (root.real > 0))
+                    branch_kept = exact & (nearest_int > 0)
+                else:
+                    invalid |= ~exact
+                    branch_kept = exact
+
+                invalid |= branch_kept & ~np.isin(nearest_int, answer_values)
+                kept.append(branch_kept)
+                nearest_ints.append(nearest_int)
+
+        valid = ~invalid & ~uncertain
+        return valid, uncertain, kept, nearest_ints
@@ -1,11 +1,13 @@
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, current_app,\
+                  Response, stream_with_context, abort
+from werkzeug.utils import secure_filename
 from flask_appbuilder import BaseView, ModelView, AppBuilder, expose, has_access
 from flask_appbuilder.models.mongoengine.interface import MongoEngineInterface
-from app import appbuilder, generator, utilities
+from app import appbuilder, batch, export, features, generator, jobs, metrics, storage, utilities
 
 import logging
 from app.forms import EquationForm, VariableForm, EquationParametersForm
-from app.models import Topics
+from app.models import Topics, Jobs
 
 
 class GenerateTopics(BaseView):
@@ -35,33 +37,65 @@ class GenerateTopics(BaseView):
                                                 variables=variables,
                                                 equation_params=equation_params)
 
-                # If submitting variable and equation params, store them in equation_dict
+                # If submitting variable and equation params, generate the topic in the background
                 if equation_params.validate_on_submit():
-                    topic_id = generator.build_topic(request.form)
+                    job_id = jobs.submit(request.form)
 
-                    return redirect(url_for('GenerateTopics.results', topic_id=topic_id))
+                    return redirect(url_for('GenerateTopics.results', job_id=job_id))
 
-            except Exception as err:
-                   print(err)
+            except Exception:
+                logging.exception('Could not process the submitted form.')
 
         self.update_redirect()
         return self.render_template('generator.html', equation_form=equation_form)
 
 
+    @expose('/estimate', methods=['POST'])
+    @has_access # password protected
+    def estimate_cost(self):
+        """
+        Return what generating the topic in the submitted variables form
+        would cost as JSON, or why it would be rejected, see
+        generator.apply_limits.
+        """
+        try:
+            cost = generator.estimate_topic(request.form)
+        except (KeyError, IndexError, ValueError) as err:
+            return jsonify(error=f'Could not read the form: {err}'), 400
+
+        return jsonify(cost)
+
+
     @expose('/results', methods=['GET', 'POST'])
     @has_access # password protected
     def results(self):
-        """Display generated problems."""
+        """
+        Display a page of generated problems, or the job's status until
+        they're ready. The page and page_size arguments pick the page.
+        """
+        if request.method == 'POST':
+            return redirect(url_for('GenerateTopics.generate'))
+
         topic_id = request.args.get('topic_id')
-        topic_data = Topics.objects.get(id=topic_id)
-        print(topic_data)
+        job_id = request.args.get('job_id')
 
-        if request.method == 'POST':
-            try:
-                return redirect(url_for('GenerateTopics.generate'))
+        if job_id:
+            job = Jobs.objects.get(id=job_id)
+            if job.status != 'done':
+                self.update_redirect()
+                return self.render_template('job.html', job=job)
+            topic_id = job.topic_id
+
+        topic_data = Topics.objects.get(id=topic_id)
 
-            except Exception as err:
-                   print(err)
+        # Pages are ranges of positions, so each one is read straight off
+        # the (topic, position) index, or from the one block holding it.
+        page = max(request.args.get('page', 1, type=int), 1)
+        page_size = request.args.get('page_size', current_app.config['RESULTS_PAGE_SIZE'], type=int)
+        page_size = min(max(page_size, 1), current_app.config['RESULTS_MAX_PAGE_SIZE'])
+        start = (page - 1) * page_size
+        problems = storage.read_problems(topic_data, start, start + page_size)
+        total = storage.count_problems(topic_data)
 
         self.update_redirect()
         return self.render_template('results.html',
@@ -69,12 +103,137 @@ class GenerateTopics(BaseView):
                                     equation=topic_data['equation'],
                                     instructions=topic_data['instructions'],
                                     categories=topic_data['categories'],
-                                    problems=topic_data['problems'])
+                                    variables=topic_data['variables'],
+                                    problems=problems,
+                                    topic_id=topic_data.id,
+                                    page=page,
+                                    page_size=page_size,
+                                    pages=max(-(-total // page_size), 1),
+                                    total=total)
+
+
+    @expose('/results/count')
+    @has_access # password protected
+    def count(self):
+        """Return the number of problems in a topic as JSON."""
+        topic_id = request.args.get('topic_id')
+
+        return jsonify(topic_id=topic_id,
+                       problems=storage.count_problems(Topics.objects.get(id=topic_id)))
+
+
+    @expose('/problems/query')
+    @has_access # password protected
+    def query(self):
+        """
+        Return up to limit problems of a topic, in order, that match the
+        feature filters in the arguments as JSON, e.g. answers=1&answer_above=0&answer_below=20
+        for problems with a single positive answer under 20. See features.FILTERS.
+        """
+        topic_id = request.args.get('topic_id')
+        limit = request.args.get('limit', 10, type=int)
+        limit = min(max(limit, 1), current_app.config['RESULTS_MAX_PAGE_SIZE'])
+        try:
+            filters = features.parse_filters(request.args)
+        except ValueError as err:
+            return jsonify(error=str(err)), 400
+
+        problems = storage.query_problems(Topics.objects.get(id=topic_id), filters, limit)
+
+        return jsonify(topic_id=topic_id, problems=problems)
+
+
+    @expose('/export')
+    @has_access # password protected
+    def download(self):
+        """Stream a topic's problems in the requested format (csv, jsonl or latex)."""
+        topic_data = Topics.objects.get(id=request.args.get('topic_id'))
+        export_format = request.args.get('format', 'csv')
+        if export_format not in export.FORMATS:
+            abort(400)
+
+        _, mimetype, extension = export.FORMATS[export_format]
+        filename = f"{secure_filename(topic_data.topic) or 'topic'}.{extension}"
+        chunks = export.stream(topic_data, export_format, current_app.config['EXPORT_BATCH_SIZE'])
+
+        return Response(stream_with_context(chunks), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+    @expose('/update', methods=['POST'])
+    @has_access # password protected
+    def update(self):
+        """Change a topic's variable ranges in the background."""
+        topic_id = request.args.get('topic_id')
+        job_id = jobs.submit(request.form, topic_id=topic_id)
+
+        return redirect(url_for('GenerateTopics.results', job_id=job_id))
+
+
+    @expose('/cancel', methods=['POST'])
+    @has_access # password protected
+    def cancel(self):
+        """Cancel a pending or running generation job."""
+        job_id = request.args.get('job_id')
+        jobs.cancel(job_id)
+
+        return redirect(url_for('GenerateTopics.results', job_id=job_id))
+
+
+    @expose('/batch', methods=['POST'])
+    @has_access # password protected
+    def submit_batch(self):
+        """
+        Queue a topic for each equation spec posted as JSON, a list or
+        {"specs": [...]}. Return the job id, or the errors if any spec is
+        invalid, in which case nothing is queued.
+        """
+        specs = request.get_json(silent=True)
+        if isinstance(specs, dict):
+            specs = specs.get('specs')
+        if not isinstance(specs, list) or not specs:
+            return jsonify(error='Post a JSON list of specs.'), 400
+
+        try:
+            batch.validate_specs(specs)
+        except batch.SpecError as err:
+            return jsonify(error=str(err).split('\n')), 400
+
+        return jsonify(job_id=str(jobs.submit_batch(specs))), 202
+
+
+    @expose('/batch/status')
+    @has_access # password protected
+    def batch_status(self):
+        """Return a batch job's status, progress and, once done, its result per spec as JSON."""
+        job = Jobs.objects.get(id=request.args.get('job_id'))
+
+        return jsonify(job_id=str(job.id),
+                       status=job.status,
+                       topics_done=job.chunks_done,
+                       topics_total=job.chunks_total,
+                       problems=job.problems,
+                       results=job.results,
+                       error=job.error)
+
 
 # Adds Generate link to persistent nav, which directs to the default_view
 appbuilder.add_view(GenerateTopics, "Generate") # Optional parameter of category=dropdown_name
 
 
+class Metrics(BaseView):
+    """Generation metrics for Prometheus to scrape ('/metrics')"""
+
+    route_base = ''
+
+    @expose('/metrics')
+    def prometheus(self):
+        """Render the metrics registry in the Prometheus text format."""
+        return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+appbuilder.add_view_no_menu(Metrics)
+
+
 """
     Database admin views
 """
@@ -86,8 +245,7 @@ class TopicsModelView(ModelView):
     label_columns = {'topic': 'Topic',
                      'equation': 'Equation',
                      'instructions': 'Instructions',
-                     'variables': 'Variables',
-                     'problems': 'Problems'}
+                     'variables': 'Variables'}
 
     # Data on summary page
     list_columns = ['topic', 'equation']
@@ -95,8 +253,7 @@ class TopicsModelView(ModelView):
     # Data on details page
     show_fieldsets = [
         ('Topic Info', {'fields': ['topic', 'equation', 'instructions']}),
-        ('Variable Info', {'fields': ['variables']}),
-        ('Problems', {'fields': ['problems']})
+        ('Variable Info', {'fields': ['variables']})
         ]
 
 appbuilder.add_view(TopicsModelView, "Database")
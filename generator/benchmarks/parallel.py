@@ -0,0 +1,67 @@
+"""
+Benchmark serial against parallel problem generation on a large topic.
+
+Runs without Mongo or Flask. Run from the generator directory:
+    python -m benchmarks.parallel --workers 8 --range 30
+"""
+
+import argparse
+import logging
+import os
+import time
+from benchmarks.suite import load_topic_class
+
+
+def make_equation_dict(equation, value_range, positive_only):
+    """Give every variable in equation the range -value_range..value_range."""
+
+    variables = [{'variable': var,
+                  'min': -value_range,
+                  'max': value_range,
+                  'zero_ok': var != 'a',
+                  'num_type': 'i'}
+                 for var in sorted(set(char for char in equation if char.isalpha()))]
+
+    return {'equation': equation,
+            'positive_only': positive_only,
+            'variables': variables}
+
+
+def time_generation(topic_class, equation_dict, **options):
+    """Return (seconds, problems) for one full generation."""
+
+    topic = topic_class(dict(equation_dict), **options)
+    start = time.perf_counter()
+    topic.generate_problems()
+    return time.perf_counter() - start, topic.dict['problems']
+
+
+def main():
+    """Time the serial path, then the parallel one, and report the speedup."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--equation', default='ax**2+bx+c=0')
+    parser.add_argument('--range', type=int, default=30)
+    parser.add_argument('--engine', default='closed_form')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--positive-only', action='store_true')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    topic_class = load_topic_class()
+    equation_dict = make_equation_dict(args.equation, args.range, args.positive_only)
+    options = {'engine': args.engine, 'chunk_size': args.chunk_size}
+
+    serial_time, serial_problems = time_generation(topic_class, equation_dict, **options)
+    parallel_time, parallel_problems = time_generation(topic_class, equation_dict, workers=args.workers, **options)
+
+    print(f'equation: {args.equation}, range: +/-{args.range}, engine: {args.engine}')
+    print(f'serial:   {serial_time:.2f}s, {len(serial_problems)} problems')
+    print(f'parallel: {parallel_time:.2f}s with {args.workers} workers')
+    print(f'speedup:  {serial_time / parallel_time:.2f}x')
+    print(f'identical output: {serial_problems == parallel_problems}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Measure cold-start latency: the time to import the app in a fresh
+interpreter, which is what every worker pays when it boots, and the time
+the warm-up then takes to get the solver ready. The slowest imports are
+listed from python -X importtime.
+
+Run from the generator directory, with the same environment as run.py:
+    python -m benchmarks.startup --output startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+GENERATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should only be imported by the warm-up
+PROBED = ('sympy', 'numpy', 'app.topic')
+
+# Written to stderr between the import and the warm-up
+MARKER = '-- warm-up'
+
+# Run in a fresh interpreter; prints its measurements as JSON on stdout
+PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+loaded = {{name: name in sys.modules for name in {PROBED!r}}}
+sys.stderr.write('{MARKER}\\n')
+from app import generator
+with app.app.app_context():
+    generator.warm_up()
+print(json.dumps({{'import_seconds': imported - start,
+                   'warm_up_seconds': time.perf_counter() - imported,
+                   'loaded_at_import': loaded}}))
+"""
+
+
+def run_probe():
+    """Run PROBE once. Return its measurements and the -X importtime report."""
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE],
+                            cwd=GENERATOR_DIR, capture_output=True, text=True, check=True)
+    measurements = json.loads(result.stdout.strip().splitlines()[-1])
+    return measurements, result.stderr
+
+
+def slowest_imports(report, top):
+    """
+    Return the top packages by time spent importing their modules while
+    the app was imported, in seconds.
+    """
+
+    packages = {}
+    for line in report.split(MARKER)[0].splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        if not own.strip().isdigit():
+            continue
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(own) / 1e6
+
+    return sorted(packages.items(), key=lambda item: -item[1])[:top]
+
+
+def main():
+    """Import the app repeat times and report the median timings."""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports listed')
+    args = parser.parse_args()
+
+    runs = [run_probe() for _ in range(args.repeat)]
+    results = {'import_seconds': statistics.median(run['import_seconds'] for run, _ in runs),
+               'warm_up_seconds': statistics.median(run['warm_up_seconds'] for run, _ in runs),
+               'loaded_at_import': runs[0][0]['loaded_at_import'],
+               'slowest_imports': slowest_imports(runs[-1][1], args.top)}
+
+    print(f"import app: {results['import_seconds']:.3f}s, "
+          f"warm-up: {results['warm_up_seconds']:.3f}s")
+    loaded = [name for name, loaded in results['loaded_at_import'].items() if loaded]
+    print(f"loaded at import: {', '.join(loaded) or 'none of ' + ', '.join(PROBED)}")
+    for package, seconds in results['slowest_imports']:
+        print(f'    {package:<30}{seconds:>8.3f}s')
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f'Wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
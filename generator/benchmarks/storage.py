@@ -0,0 +1,64 @@
+"""
+Compare the size of a large topic's problems stored as Problems documents
+against compact blocks, and time packing, unpacking and rendering them.
+
+Run from the generator directory, with the same environment as run.py:
+    python -m benchmarks.storage --equation ax+b=c --range 30
+"""
+
+import argparse
+import logging
+import time
+import bson
+from app import compact
+from app.topic import Topic
+from benchmarks.parallel import make_equation_dict
+
+
+def document_bytes(problems, topic_id):
+    """Return the BSON size of problems as Problems documents."""
+
+    return sum(len(bson.encode(dict(problem, topic=topic_id, position=position)))
+               for position, problem in enumerate(problems))
+
+
+def main():
+    """Generate a topic, store it both ways and report the sizes and timings."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--equation', default='ax+b=c')
+    parser.add_argument('--range', type=int, default=30)
+    parser.add_argument('--block-size', type=int, default=10000)
+    parser.add_argument('--positive-only', action='store_true')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    topic = Topic(make_equation_dict(args.equation, args.range, args.positive_only))
+    topic.generate_problems()
+    problems = topic.dict['problems']
+    blocks = range(0, len(problems), args.block_size)
+
+    start = time.perf_counter()
+    data = [compact.encode(problems[i:i + args.block_size], topic.variables) for i in blocks]
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = [problem for block in data for problem in compact.decode(block, topic.variables)]
+    decode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    topic.write_problems(decoded)
+    render_time = time.perf_counter() - start
+
+    documents = document_bytes(problems, bson.ObjectId())
+    packed = sum(len(block) for block in data)
+    print(f'equation: {args.equation}, range: +/-{args.range}, {len(problems)} problems')
+    print(f'documents: {documents / 1e6:.2f} MB')
+    print(f'compact:   {packed / 1e6:.2f} MB in {len(data)} blocks, '
+          f'{documents / packed:.1f}x smaller')
+    print(f'encode: {encode_time:.2f}s, decode: {decode_time:.2f}s, render: {render_time:.2f}s')
+    print(f'identical output: {decoded == problems}')
+
+
+if __name__ == '__main__':
+    main()
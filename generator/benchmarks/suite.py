@@ -0,0 +1,241 @@
+"""
+Benchmark Topic.generate_problems over a fixed corpus of equations and
+range sizes, recording wall time, time per pipeline stage, peak memory and
+problems per second. Results are written as JSON, and a previous results
+file can be passed to compare the two runs.
+
+Runs without Mongo or Flask. Run from the generator directory:
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --output new.json --compare results.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+from datetime import datetime
+
+
+GENERATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, equation, positive_only)
+CORPUS = [('linear', 'x+a=b', False),
+          ('two_step', 'ax+b=c', False),
+          ('two_step_positive', 'ax+b=c', True),
+          ('fraction', 'x/a+b=c', False),
+          ('quadratic', 'x**2+bx+c=0', False),
+          ('quadratic_positive', 'x**2+bx+c=0', True),
+          ('quadratic_general', 'ax**2+bx+c=0', False),
+          ('multi_variable', 'ax+b=cx+d', False)]
+
+# Every variable ranges over -size..size
+RANGE_SIZES = [5, 10, 20]
+
+# Cases with at least TEMPLATE_MIN_PROBLEMS problems must fill at least
+# this fraction of them from LaTeX templates, without sympy. Smaller cases
+# are dominated by rendering each template's first problems.
+MIN_TEMPLATE_HIT_RATE = 0.8
+TEMPLATE_MIN_PROBLEMS = 5000
+
+# Topic methods timed as pipeline stages. Times are inclusive, so a stage
+# that falls back to another includes its time.
+STAGES = ['prep_equation', 'compile_solver', 'generate_input_rows', 'generate_valid_combos',
+          'generate_valid_combos_vectorized', 'write_problems']
+
+
+def load_topic_class():
+    """
+    Import app.topic without running app/__init__.py, which builds the
+    Flask app and connects to Mongo. None of the pipeline modules need it.
+    """
+
+    if 'app' not in sys.modules:
+        package = types.ModuleType('app')
+        package.__path__ = [os.path.join(GENERATOR_DIR, 'app')]
+        sys.modules['app'] = package
+
+    from app.topic import Topic # pylint: disable=C0415
+    return Topic
+
+
+def make_equation_dict(equation, size, positive_only):
+    """Give every variable in equation the range -size..size."""
+
+    variables = [{'variable': var,
+                  'min': -size,
+                  'max': size,
+                  'zero_ok': True,
+                  'num_type': 'i'}
+                 for var in sorted(set(char for char in equation if char.isalpha()))]
+
+    return {'equation': equation,
+            'positive_only': positive_only,
+            'variables': variables}
+
+
+def instrument(topic, stage_times):
+    """Wrap the stages of topic so their time adds up in stage_times."""
+
+    def timed(name, method):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stage_times[name] = stage_times.get(name, 0.0) + time.perf_counter() - start
+        return wrapper
+
+    for name in STAGES:
+        setattr(topic, name, timed(name, getattr(topic, name)))
+
+
+def run_case(topic_class, equation_dict, options, repeat, measure_memory):
+    """
+    Generate one topic repeat times and return its measurements. An
+    untimed run first takes the one-off costs, like sympy's caches.
+    """
+
+    topic_class(json.loads(json.dumps(equation_dict)), **options).generate_problems()
+
+    runs = []
+    for _ in range(repeat):
+        topic = topic_class(json.loads(json.dumps(equation_dict)), **options)
+        stage_times = {}
+        instrument(topic, stage_times)
+
+        start = time.perf_counter()
+        topic.generate_problems()
+        runs.append((time.perf_counter() - start, stage_times))
+
+    wall_times = [wall for wall, _ in runs]
+    best_wall, best_stages = min(runs, key=lambda run: run[0])
+    result = {'combinations': topic.count_combinations(topic.generate_var_ranges()),
+              'problems': len(topic.dict['problems']),
+              'pruned': topic.pruned,
+              'wall_seconds': best_wall,
+              'wall_seconds_median': statistics.median(wall_times),
+              'problems_per_second': len(topic.dict['problems']) / best_wall if best_wall else None,
+              'stage_seconds': best_stages,
+              'template_hit_rate': topic.templates.hit_rate() if topic.templates else None,
+              'peak_memory_bytes': None}
+
+    # Tracing slows generation down, so memory gets a run of its own
+    if measure_memory:
+        topic = topic_class(json.loads(json.dumps(equation_dict)), **options)
+        tracemalloc.start()
+        topic.generate_problems()
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result
+
+
+def environment():
+    """Describe what the results were measured on."""
+
+    import numpy # pylint: disable=C0415
+    import sympy # pylint: disable=C0415
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=GENERATOR_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'timestamp': datetime.utcnow().isoformat(),
+            'commit': commit,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'numpy': numpy.__version__,
+            'sympy': sympy.__version__}
+
+
+def compare(results, previous):
+    """Print the wall time of each case against a previous run."""
+
+    before = {(case['name'], case['size'], case['engine']): case for case in previous['cases']}
+    print(f"\n{'case':<40}{'before':>10}{'after':>10}{'ratio':>8}")
+    for case in results['cases']:
+        old = before.get((case['name'], case['size'], case['engine']))
+        if old is None:
+            continue
+        label = f"{case['name']} {case['engine']} +/-{case['size']}"
+        ratio = case['wall_seconds'] / old['wall_seconds'] if old['wall_seconds'] else float('nan')
+        print(f"{label:<40}{old['wall_seconds']:>10.3f}{case['wall_seconds']:>10.3f}{ratio:>8.2f}")
+        if old['problems'] != case['problems']:
+            print(f"    problem count changed: {old['problems']} -> {case['problems']}")
+
+
+def check_template_hit_rates(results):
+    """Return a message for each large case below MIN_TEMPLATE_HIT_RATE."""
+
+    return [f"{case['name']} {case['engine']} +/-{case['size']}: "
+            f"{case['template_hit_rate']:.2f} of problems filled from templates"
+            for case in results['cases']
+            if case['problems'] >= TEMPLATE_MIN_PROBLEMS
+            and case['template_hit_rate'] < MIN_TEMPLATE_HIT_RATE]
+
+
+def main():
+    """Run every case of the corpus and write the results."""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='previous results file to compare against')
+    parser.add_argument('--engines', nargs='+', default=['closed_form', 'numpy'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=RANGE_SIZES)
+    parser.add_argument('--cases', nargs='+', help='names of the corpus cases to run')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-combinations', type=int, default=2000000,
+                        help='skip cases with more combinations than this')
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory runs')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    topic_class = load_topic_class()
+    results = {'environment': environment(),
+               'options': vars(args),
+               'cases': []}
+
+    for name, equation, positive_only in CORPUS:
+        if args.cases and name not in args.cases:
+            continue
+        for size in args.sizes:
+            equation_dict = make_equation_dict(equation, size, positive_only)
+            combinations = (2 * size + 1) ** (len(equation_dict['variables']) - 1)
+            if combinations > args.max_combinations:
+                continue
+            for engine in args.engines:
+                case = run_case(topic_class, equation_dict, {'engine': engine},
+                                args.repeat, not args.no_memory)
+                case.update({'name': name, 'equation': equation, 'positive_only': positive_only,
+                             'size': size, 'engine': engine})
+                results['cases'].append(case)
+                print(f"{name:<20}{engine:<13}+/-{size:<4}{case['wall_seconds']:>8.3f}s"
+                      f"{case['problems']:>9} problems{case['problems_per_second'] or 0:>11.0f}/s"
+                      f"{case['template_hit_rate'] or 0:>7.2f} templated")
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print(f'Wrote {args.output}')
+
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(results, json.load(previous))
+
+    failures = check_template_hit_rates(results)
+    if failures:
+        sys.exit(f'Template hit rate below {MIN_TEMPLATE_HIT_RATE}:\n    '
+                 + '\n    '.join(failures))
+
+
+if __name__ == '__main__':
+    main()
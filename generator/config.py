@@ -55,6 +55,77 @@ AUTH_TYPE = AUTH_DB
 #    { 'name': 'Flickr', 'url': 'http://www.flickr.com/<username>' },
 #    { 'name': 'MyOpenID', 'url': 'https://www.myopenid.com' }]
 #---------------------------------------------------
+# Logging config
+#---------------------------------------------------
+LOG_LEVEL = 'INFO'
+LOG_FORMAT = '%(asctime)s:%(levelname)s:%(name)s:%(message)s'
+# Write log records from a background thread instead of the request's
+LOG_QUEUE = True
+#---------------------------------------------------
+# Problem generation config
+#---------------------------------------------------
+# Number of variable combinations solved per step of the pipeline
+TOPIC_CHUNK_SIZE = 10000
+# Hard cap on the number of problems generated for a single topic
+TOPIC_MAX_PROBLEMS = 100000
+# 'serial' solves in the request's process, 'parallel' uses a process pool
+TOPIC_EXECUTION = 'serial'
+# Number of processes in the pool when TOPIC_EXECUTION is 'parallel'
+TOPIC_WORKERS = os.cpu_count()
+# Number of topics that can be generated in the background at once
+JOB_WORKERS = 2
+# Number of processes a batch of topics is solved across, one topic each
+BATCH_WORKERS = os.cpu_count()
+# Limits for the in-process cache of generated problems, in topics and
+# in problems across all cached topics
+TOPIC_CACHE_SIZE = 32
+TOPIC_CACHE_MAX_PROBLEMS = 200000
+# Number of equation shapes whose solvers are kept per process, and the
+# file their symbolic solutions are saved to so they survive restarts, if
+# any. The file is unpickled on first use, so it must only be written by this app
+SHAPE_CACHE_SIZE = 128
+SHAPE_CACHE_PATH = None
+# Number of problems sent to Mongo per insert_many
+PROBLEM_BATCH_SIZE = 1000
+# Number of those batches that can wait to be written while solving goes on
+PROBLEM_WRITE_AHEAD = 4
+# How new topics store their problems: 'documents', one Problems document
+# each, or 'compact', compressed blocks of PROBLEM_BLOCK_SIZE problems whose
+# LaTeX is rendered when they're read, about a tenth of the size
+PROBLEM_STORAGE = 'documents'
+PROBLEM_BLOCK_SIZE = 10000
+# Import and prepare the solver in the background when a worker starts
+# serving, rather than on its first generation
+WARM_UP = True
+# Save each topic's generation metrics on its Topics document
+TOPIC_STATS = True
+# Where profiles go when a generation request asks for one
+PROFILE_DIR = os.path.join(basedir, 'profiles')
+#---------------------------------------------------
+# Generation limits config
+#---------------------------------------------------
+# Topics with more combinations than ESTIMATE_COMBINATIONS have their cost
+# estimated before they're generated, by solving a random sample of them
+# for up to ESTIMATE_SECONDS
+ESTIMATE_COMBINATIONS = 5000
+ESTIMATE_SECONDS = 0.5
+# Predicted time and memory a single topic may take
+GENERATION_MAX_SECONDS = 600
+GENERATION_MAX_MEMORY = 2 * 1024**3
+# What to do with a topic predicted to go over: 'reject' it, or 'adapt' it
+# by switching to the numpy engine, then to the largest random sample that
+# fits, and reject it only if neither does
+GENERATION_OVER_LIMIT = 'adapt'
+#---------------------------------------------------
+# Results config
+#---------------------------------------------------
+# Problems shown per page of results, unless the page_size argument asks
+# for a different number, up to RESULTS_MAX_PAGE_SIZE
+RESULTS_PAGE_SIZE = 100
+RESULTS_MAX_PAGE_SIZE = 1000
+# Problems read from the cursor and sent per chunk of an export
+EXPORT_BATCH_SIZE = 1000
+#---------------------------------------------------
 # Babel config for translations
 #---------------------------------------------------
 # Setup default language
@@ -0,0 +1,9 @@
+"""
+Load the app package without building the Flask app or connecting to
+Mongo, like the benchmarks do. See benchmarks/suite.py.
+"""
+
+from benchmarks.suite import load_topic_class
+
+
+load_topic_class()
@@ -0,0 +1,181 @@
+"""
+ProblemWriter batching, and what build_topic leaves behind when it stops
+partway through. Runs against mongomock instead of a Mongo server.
+"""
+
+import os
+import threading
+import time
+import pytest
+from flask import Flask
+from werkzeug.datastructures import MultiDict
+
+
+mongomock = pytest.importorskip('mongomock')
+mongoengine = pytest.importorskip('mongoengine')
+
+# pylint: disable=C0413, W0621
+from app import cache, generator, jobs
+from app.models import Topics, Problems, ProblemCache, Variables
+from app.persistence import ProblemWriter
+from app.topic import Topic
+
+
+class RecordingCollection():
+    """Wrap a collection, recording the positions of each batch inserted."""
+
+    def __init__(self, collection, release=None):
+        self.collection = collection
+        self.release = release
+        self.batches = []
+
+    def insert_many(self, batch, ordered=True):
+        if self.release is not None:
+            self.release.wait()
+        self.batches.append([problem['position'] for problem in batch])
+        return self.collection.insert_many(batch, ordered=ordered)
+
+
+@pytest.fixture(scope='module')
+def connection():
+    connection = mongoengine.connect('test', mongo_client_class=mongomock.MongoClient)
+    yield connection
+    mongoengine.disconnect()
+
+
+@pytest.fixture
+def db(connection):
+    for document in (Topics, Problems, ProblemCache):
+        document.drop_collection()
+    yield connection
+
+
+@pytest.fixture
+def app(db, monkeypatch):
+    # Each test generates its topic afresh
+    monkeypatch.setattr(cache, 'memory_cache', None)
+    os.environ.setdefault('SECRET_KEY', 'test')
+    app = Flask(__name__)
+    app.config.from_object('config')
+    app.config.update(TOPIC_CHUNK_SIZE=20, PROBLEM_BATCH_SIZE=7, PROBLEM_WRITE_AHEAD=2,
+                      TOPIC_EXECUTION='serial', TOPIC_STATS=False)
+    with app.app_context():
+        yield app
+
+
+def save_topic():
+    """Save a topic to write problems for."""
+
+    return Topics(equation='x=a', topic='t', instructions='i', categories=['c'],
+                  variables=[Variables(variable=var, min=0, max=9) for var in 'ax']).save()
+
+
+def make_problems(start, stop):
+    """Return problems x = i for i in start..stop-1."""
+
+    return [{'values': {'x': [i]}, 'problem': f'x = {i}', 'answer': f'x = {i}'}
+            for i in range(start, stop)]
+
+
+def saved_answers(topic_id):
+    """Return the saved answers of a topic in position order."""
+
+    return [problem.answer for problem in Problems.objects(topic=topic_id).order_by('position')]
+
+
+def test_batches_keep_order_across_chunks(db):
+    topic = save_topic()
+
+    with ProblemWriter(topic.id, batch_size=4, write_ahead=2) as writer:
+        writer.collection = RecordingCollection(writer.collection)
+        recorder = writer.collection
+        for start, stop in ((0, 3), (3, 4), (4, 13), (13, 13), (13, 18)):
+            writer.add(make_problems(start, stop))
+
+    assert [len(batch) for batch in recorder.batches] == [4, 4, 4, 4, 2]
+    assert [position for batch in recorder.batches for position in batch] == list(range(18))
+    assert saved_answers(topic.id) == [f'x = {i}' for i in range(18)]
+
+
+def test_write_ahead_blocks_add(db):
+    topic = save_topic()
+    release = threading.Event()
+
+    writer = ProblemWriter(topic.id, batch_size=1, write_ahead=2)
+    writer.collection = recorder = RecordingCollection(writer.collection, release)
+    adding = threading.Thread(target=writer.add, args=(make_problems(0, 5),))
+    adding.start()
+
+    # The first batch is stuck writing, so add() waits on it once a third
+    # is queued, with two others still waiting behind it
+    try:
+        time.sleep(0.2)
+        assert adding.is_alive()
+        assert writer.position == 3
+        assert len(writer.pending) == writer.write_ahead
+        assert recorder.batches == []
+    finally:
+        release.set()
+        adding.join(timeout=5)
+    writer.close()
+    assert not adding.is_alive()
+    assert saved_answers(topic.id) == [f'x = {i}' for i in range(5)]
+
+
+def test_abort_drops_unsent_problems(db):
+    topic = save_topic()
+
+    with pytest.raises(RuntimeError):
+        with ProblemWriter(topic.id, batch_size=4) as writer:
+            writer.add(make_problems(0, 6))
+            raise RuntimeError
+
+    assert saved_answers(topic.id) == [f'x = {i}' for i in range(4)]
+
+
+FORM = [('eq', 'ax+b=c'),
+        ('variable', 'a'), ('minimum', '-6'), ('maximum', '6'),
+        ('variable', 'b'), ('minimum', '-6'), ('maximum', '6'), ('zero_ok', 'b'),
+        ('variable', 'c'), ('minimum', '-6'), ('maximum', '6'), ('zero_ok', 'c'),
+        ('variable', 'x'), ('minimum', '-6'), ('maximum', '6'), ('zero_ok', 'x'),
+        ('topic', 'Two-step'), ('instructions', 'Solve'), ('categories', 'Algebra')]
+
+
+def test_build_topic_saves_every_chunk(app):
+    chunks = []
+    topic_id = generator.build_topic(MultiDict(FORM),
+                                     progress=lambda done, total, problems: chunks.append(done))
+
+    assert len(chunks) > 2
+    assert Topics.objects.count() == 1
+    assert Problems.objects(topic=topic_id).count() > app.config['PROBLEM_BATCH_SIZE']
+
+
+def test_build_topic_deletes_a_cancelled_topic(app):
+    def cancel_after_two(done, total, problems):
+        if done == 2:
+            raise jobs.JobCancelled
+
+    with pytest.raises(jobs.JobCancelled):
+        generator.build_topic(MultiDict(FORM), progress=cancel_after_two)
+
+    assert Topics.objects.count() == 0
+    assert Problems.objects.count() == 0
+
+
+def test_build_topic_deletes_a_failed_topic(app, monkeypatch):
+    solve_chunk = Topic.solve_chunk
+    solved = []
+
+    def fail_third_chunk(self, *args):
+        solved.append(args)
+        if len(solved) == 3:
+            raise ValueError('solver failed')
+        return solve_chunk(self, *args)
+
+    monkeypatch.setattr(Topic, 'solve_chunk', fail_third_chunk)
+    with pytest.raises(ValueError):
+        generator.build_topic(MultiDict(FORM))
+
+    assert Topics.objects.count() == 0
+    assert Problems.objects.count() == 0
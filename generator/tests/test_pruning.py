@@ -0,0 +1,88 @@
+"""
+Pruning must never change the problems generated, only skip combinations
+that can't be valid, so each case is generated with and without it.
+"""
+
+import numpy as np
+import pytest
+from benchmarks.suite import load_topic_class
+
+
+Topic = load_topic_class()
+
+
+def make_topic(equation, ranges, positive_only=False, **options):
+    """Return a Topic of equation with {variable: (min, max)} ranges."""
+
+    variables = [{'variable': var, 'min': low, 'max': high, 'zero_ok': True, 'num_type': 'i'}
+                 for var, (low, high) in sorted(ranges.items())]
+    return Topic({'equation': equation, 'positive_only': positive_only, 'variables': variables},
+                 **options)
+
+
+def generate(equation, ranges, positive_only=False, **options):
+    """Return the problems of each Topic, pruned and not, and the pruned Topic."""
+
+    problems = []
+    for prune in (True, False):
+        topic = make_topic(equation, ranges, positive_only, prune=prune, **options)
+        topic.generate_problems()
+        problems.append(topic.dict['problems'])
+        if prune:
+            pruned = topic
+
+    return problems[0], problems[1], pruned
+
+
+@pytest.mark.parametrize('engine', ['closed_form', 'numpy'])
+@pytest.mark.parametrize('positive_only', [False, True])
+@pytest.mark.parametrize('equation, ranges', [
+    ('ax+b=c', {'a': (-6, 6), 'b': (-6, 6), 'c': (-6, 6), 'x': (-4, 4)}),
+    ('x**2+bx+c=0', {'b': (-9, 9), 'c': (-12, 12), 'x': (-6, 6)}),
+    ('ax**2+bx+c=0', {'a': (-3, 3), 'b': (-6, 6), 'c': (-6, 6), 'x': (-5, 5)}),
+])
+def test_pruning_keeps_problems(equation, ranges, positive_only, engine):
+    pruned, unpruned, topic = generate(equation, ranges, positive_only, engine=engine)
+
+    assert pruned == unpruned
+    assert unpruned
+    assert topic.pruned > 0
+
+
+def test_pruning_with_an_input_denominator():
+    # Combinations where a is 0 are degenerate and left to the solver
+    pruned, unpruned, topic = generate('x/a+b=c', {'a': (-4, 4), 'b': (-5, 5), 'c': (-5, 5),
+                                                   'x': (-8, 8)})
+
+    assert pruned == unpruned
+    assert unpruned
+    assert topic.pruner is not None and topic.pruned > 0
+
+
+def test_pruning_without_a_pruner():
+    # x in the denominator can cancel a root, so nothing is pruned
+    pruned, unpruned, topic = generate('a/x=b', {'a': (-4, 4), 'b': (-4, 4), 'x': (-4, 4)})
+
+    assert pruned == unpruned
+    assert topic.pruner is None and topic.pruned == 0
+
+
+@pytest.mark.parametrize('engine', ['closed_form', 'numpy'])
+def test_pruning_past_int64(engine):
+    # b*c - d could overflow int64 once b passes about 1518500250, so
+    # rows on one side are pruned and the rest are left to the solver
+    big = 1518500250
+    pruned, unpruned, topic = generate('ax+bc=d', {'a': (1, 3), 'b': (big - 4, big + 4),
+                                                   'c': (1, 1), 'd': (big - 4, big + 4),
+                                                   'x': (-3, 3)},
+                                       engine=engine)
+
+    assert pruned == unpruned
+    assert unpruned
+    assert topic.pruned > 0
+
+    var_ranges = topic.generate_var_ranges()
+    columns = [np.array(column, dtype=np.int64) for column in
+               zip(*topic.generate_input_array(var_ranges))]
+    _, safe = topic.pruner.evaluate(columns)
+    assert safe.any() and not safe.all()
@@ -0,0 +1,87 @@
+"""
+Topics whose equations differ only in their letters share one solved
+shape, and each still gets its own problems from it.
+"""
+
+import pytest
+from benchmarks.suite import load_topic_class
+from app import shapes
+
+
+Topic = load_topic_class()
+
+
+@pytest.fixture
+def shape_cache(monkeypatch):
+    cache = shapes.ShapeCache(shapes.DEFAULT_SIZE)
+    monkeypatch.setattr(shapes, 'shape_cache', cache)
+    return cache
+
+
+def make_topic(equation, size=6, **options):
+    """Return a Topic of equation with every variable in -size..size."""
+
+    variables = [{'variable': var, 'min': -size, 'max': size, 'zero_ok': True, 'num_type': 'i'}
+                 for var in sorted(set(char for char in equation if char.isalpha()))]
+    return Topic({'equation': equation, 'positive_only': False, 'variables': variables},
+                 **options)
+
+
+def shape_key(equation):
+    """Return the shape key of equation."""
+
+    topic = make_topic(equation)
+    return shapes.shape_key(topic.prep_equation(), [var['variable'] for var in topic.variables])
+
+
+def generate(equation, **options):
+    """Return the problems generated for equation."""
+
+    topic = make_topic(equation, **options)
+    topic.generate_problems()
+    return topic.dict['problems']
+
+
+@pytest.mark.parametrize('first, second', [('ax+b=c', 'my+n=k'),
+                                           ('ax**2+bx+c=0', 'cx**2+ax+b=0'),
+                                           ('ax+b=cx+d', 'bx+d=ax+c')])
+def test_renamed_equations_share_a_shape(first, second, shape_cache):
+    assert shape_key(first)[0] == shape_key(second)[0]
+
+    generate(first)
+    generate(second)
+    assert len(shape_cache.entries) == 1
+    assert shape_cache.hits >= 1
+
+
+@pytest.mark.parametrize('engine', ['closed_form', 'numpy'])
+@pytest.mark.parametrize('first, second', [('ax+b=c', 'my+n=k'),
+                                           ('ax**2+bx+c=0', 'cx**2+ax+b=0'),
+                                           ('ax+b=cx+d', 'bx+d=ax+c')])
+def test_shared_shapes_solve_each_topic(first, second, engine, shape_cache):
+    generate(first, engine=engine)
+    shared = generate(second, engine=engine)
+
+    assert shared
+    assert shared == generate(second, engine='solveset', prune=False)
+
+
+def test_inputs_are_reordered_for_the_shape():
+    _, _, order = shape_key('ax**2+bx+c=0')
+    _, _, other = shape_key('cx**2+ax+b=0')
+
+    assert order != other
+
+
+def test_the_shape_file_is_read_on_first_use(tmp_path, monkeypatch):
+    path = str(tmp_path / 'shapes.pickle')
+    key = shape_key('ax+b=c')[0]
+    shapes.ShapeCache(shapes.DEFAULT_SIZE, path).save({key: None})
+
+    monkeypatch.setattr(shapes, 'shape_cache', shapes.shape_cache)
+    shapes.configure({'SHAPE_CACHE_SIZE': 4, 'SHAPE_CACHE_PATH': path})
+    assert not shapes.shape_cache.loaded
+    assert not shapes.shape_cache.entries
+
+    assert shapes.shape_cache.get(key) is not None
+    assert shapes.shape_cache.loaded